@@ -1,3 +1,4 @@
+import sys
 from anki import hooks
 from aqt import gui_hooks
 from aqt import mw
@@ -7,9 +8,22 @@ from aqt.utils import showInfo, qconnect
 from anki.hooks import addHook, wrap
 
 from PyQt5 import QtCore, QtGui, QtWidgets
-from .gui import gui
+from .model.startup import startup_timer
+with startup_timer.phase("import gui"):
+    from .gui import gui
 from model import model
+from .model.metadata_cache import schema_cache
 
 addHook('profileLoaded', gui.load_menu)
 addHook('profileLoaded', model.load_config)
-addHook('unloadProfile', gui.unload_menus)
\ No newline at end of file
+addHook('unloadProfile', gui.unload_menus)
+# another profile has its own note types and decks
+addHook('unloadProfile', schema_cache.invalidate)
+
+def shutdown_parallel():
+    # the pool only exists if a sync imported model.parallel and started it; don't import it just to stop it
+    parallel = sys.modules.get(f"{__name__}.model.parallel")
+    if parallel != None:
+        parallel.shutdown()
+
+addHook('unloadProfile', shutdown_parallel)
\ No newline at end of file
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+from core.dataset import *
+from core.sync.sync_types import *
+from anki_testing import anki_running
+
+# Throughput benchmarks for reading, transforming, merging and writing.
+# Run with: python benchmark.py --sizes 10000 100000 1000000
+# Each result is one JSON line in the output file, tagged with the current commit so that
+# runs can be compared across commits.
+
+DEFAULT_SIZES = [10000, 100000]
+DEFAULT_WIDTHS = [5, 20]
+
+def make_dataset(rows : int, width : int, html : bool, id_offset : int = 0) -> DataSet:
+    cols = [ DataColumn(COLUMN_TYPE.TEXT, "id"), DataColumn(COLUMN_TYPE.DATE, "date"), DataColumn(COLUMN_TYPE.MULTI_SELECT, "multiselect") ]
+    cols.extend( DataColumn(COLUMN_TYPE.TEXT, f"field_{i}") for i in range(width - len(cols)) )
+    start = datetime(2000, 1, 1)
+    records = []
+    for r in range(rows):
+        record = { "id": str(r + id_offset), "date": start + timedelta(minutes=r), "multiselect": [str(r % 7), str(r % 11)] }
+        for i in range(width - 3):
+            if html:
+                record[f"field_{i}"] = f"<div><b>row {r}</b> field {i}</div><div>back&nbsp;side &amp; more<br>text</div>"
+            else:
+                record[f"field_{i}"] = f"row {r} field {i} some plain text"
+        records.append(record)
+    return DataSet(cols, records)
+
+def commit_hash() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+class Benchmark():
+    def __init__(self, out_path : str, page_size : int):
+        self.out_path = out_path
+        self.page_size = page_size
+        self.commit = commit_hash()
+
+    def record(self, stage : str, rows : int, width : int, html : bool, seconds : float):
+        result = {
+            "commit": self.commit,
+            "stage": stage,
+            "rows": rows,
+            "width": width,
+            "html": html,
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else None
+        }
+        print(json.dumps(result))
+        with open(self.out_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+
+    def run(self, sizes : list, widths : list):
+        import model.sync_anki as sa
+        from model.dataset_index import indexed_merge, SOFT_MERGE
+        type_clean = {
+            COLUMN_TYPE.SELECT: COLUMN_TYPE.TEXT,
+            COLUMN_TYPE.DATE: COLUMN_TYPE.TEXT,
+            COLUMN_TYPE.MULTI_SELECT: COLUMN_TYPE.TEXT
+        }
+        for rows in sizes:
+            for width in widths:
+                for html in (False, True):
+                    ds = make_dataset(rows, width, html)
+                    name = f"Benchmark {rows}x{width}{' html' if html else ''}"
+
+                    start = time.perf_counter()
+                    ds.make_write_safe(type_clean)
+                    self.record("make_write_safe", rows, width, html, time.perf_counter() - start)
+
+                    # half the rows overlap, half are new
+                    other = make_dataset(rows, width, html, rows // 2)
+                    start = time.perf_counter()
+                    indexed_merge(other, ds, "id", SOFT_MERGE)
+                    self.record("merge", rows, width, html, time.perf_counter() - start)
+
+                    aw = sa.AnkiWriter({})
+                    table = aw.create_table(ds, name)
+                    aw.set_table(table)
+                    start = time.perf_counter()
+                    it = aw.write_records_sync(ds, self.page_size)
+                    while not it.done:
+                        it = aw.write_records_sync(ds, self.page_size, it)
+                    self.record("anki_write", rows, width, html, time.perf_counter() - start)
+
+                    ar = sa.AnkiReader({"table": table})
+                    start = time.perf_counter()
+                    it = ar.read_records_sync(self.page_size)
+                    while not it.done:
+                        it = ar.read_records_sync(self.page_size, it)
+                    self.record("anki_read", rows, width, html, time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Anchor throughput benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--widths", type=int, nargs="+", default=DEFAULT_WIDTHS)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--out", default="./test_output/benchmarks.jsonl")
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with anki_running():
+        Benchmark(args.out, args.page_size).run(args.sizes, args.widths)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import json
+import random
+import re
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+# Local stand-in for the Notion API, for offline load and latency testing.
+# Serves search, database retrieval, database queries (start_cursor / has_more pagination) and
+# page create / retrieve / update, with configurable latency, rate limiting, 429 injection and
+# dataset size. Point a NotionTransport at FakeNotion.base_url, or run it standalone:
+#     python fake_notion.py --port 8765 --rows 10000 --latency 0.2 --rate-limit 3
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+def _rich_text(text : str) -> list:
+    return [{"type": "text", "text": {"content": text}, "plain_text": text}]
+
+SCHEMA = {
+    "Name": {"id": "title", "type": "title", "title": {}},
+    "Text": {"id": "text", "type": "rich_text", "rich_text": {}},
+    "Tag": {"id": "tag", "type": "select", "select": {"options": []}},
+    "Tags": {"id": "tags", "type": "multi_select", "multi_select": {"options": []}},
+    "Date": {"id": "date", "type": "date", "date": {}}
+}
+
+def make_page(database_id : str, n : int, edited : str) -> dict:
+    start = datetime(2020, 1, 1)
+    return {
+        "object": "page",
+        "id": str(uuid.uuid4()),
+        "created_time": edited,
+        "last_edited_time": edited,
+        "archived": False,
+        "parent": {"type": "database_id", "database_id": database_id},
+        "properties": {
+            "Name": {"id": "title", "type": "title", "title": _rich_text(f"Row {n}")},
+            "Text": {"id": "text", "type": "rich_text", "rich_text": _rich_text(f"Text for row {n}")},
+            "Tag": {"id": "tag", "type": "select", "select": {"name": f"tag{n % 5}"}},
+            "Tags": {"id": "tags", "type": "multi_select", "multi_select": [{"name": f"t{n % 3}"}, {"name": f"t{n % 7}"}]},
+            "Date": {"id": "date", "type": "date", "date": {"start": (start + timedelta(days=n)).date().isoformat()}}
+        }
+    }
+
+class FakeNotion():
+    '''In-memory Notion workspace served over HTTP on a background thread.'''
+    def __init__(self, port : int = 0, databases : int = 1, rows : int = 1000, latency : float = 0.0, jitter : float = 0.0,
+                 rate_limit : float = None, error_rate : float = 0.0, retry_after : float = 1.0):
+        # seconds added to every response, plus up to jitter more
+        self.latency = latency
+        self.jitter = jitter
+        # requests a second allowed before answering 429; None for unlimited
+        self.rate_limit = rate_limit
+        # fraction of requests answered with an injected 429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._window = []
+        self.databases = {}
+        self.pages = {}
+        edited = _now()
+        for d in range(databases):
+            database_id = str(uuid.uuid4())
+            self.databases[database_id] = {
+                "object": "database",
+                "id": database_id,
+                "title": _rich_text(f"Database {d}"),
+                "properties": SCHEMA
+            }
+            for n in range(rows):
+                page = make_page(database_id, n, edited)
+                self.pages[page["id"]] = page
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _throttled(self) -> bool:
+        with self.lock:
+            self.request_count += 1
+            if self.error_rate > 0 and random.random() < self.error_rate:
+                self.rate_limited_count += 1
+                return True
+            if self.rate_limit == None:
+                return False
+            now = monotonic()
+            self._window = [ t for t in self._window if now - t < 1.0 ]
+            if len(self._window) >= self.rate_limit:
+                self.rate_limited_count += 1
+                return True
+            self._window.append(now)
+            return False
+
+    def _database_pages(self, database_id : str) -> list:
+        with self.lock:
+            return [ p for p in self.pages.values() if p["parent"]["database_id"] == database_id and not p["archived"] ]
+
+    def query(self, database_id : str, body : dict):
+        if database_id not in self.databases:
+            return 404, {"object": "error", "status": 404, "code": "object_not_found"}
+        pages = self._database_pages(database_id)
+        edited_filter = (body.get("filter") or {}).get("last_edited_time", {})
+        if "on_or_after" in edited_filter:
+            pages = [ p for p in pages if p["last_edited_time"] >= edited_filter["on_or_after"] ]
+        page_size = min(int(body.get("page_size", 100)), 100)
+        start = int(body.get("start_cursor") or 0)
+        results = pages[start:start + page_size]
+        has_more = start + page_size < len(pages)
+        return 200, {"object": "list", "results": results, "has_more": has_more, "next_cursor": str(start + page_size) if has_more else None}
+
+    def create_page(self, body : dict):
+        database_id = (body.get("parent") or {}).get("database_id")
+        if database_id not in self.databases:
+            return 404, {"object": "error", "status": 404, "code": "object_not_found"}
+        edited = _now()
+        page = {"object": "page", "id": str(uuid.uuid4()), "created_time": edited, "last_edited_time": edited, "archived": False,
+                "parent": {"type": "database_id", "database_id": database_id}, "properties": body.get("properties", {})}
+        with self.lock:
+            self.pages[page["id"]] = page
+        return 200, page
+
+    def update_page(self, page_id : str, body : dict):
+        with self.lock:
+            page = self.pages.get(page_id)
+            if page == None:
+                return 404, {"object": "error", "status": 404, "code": "object_not_found"}
+            page["properties"].update(body.get("properties", {}))
+            if "archived" in body:
+                page["archived"] = bool(body["archived"])
+            page["last_edited_time"] = _now()
+            return 200, page
+
+    def route(self, method : str, path : str, body : dict):
+        if method == "POST" and path == "/v1/search":
+            return 200, {"object": "list", "results": list(self.databases.values()), "has_more": False, "next_cursor": None}
+        match = re.fullmatch(r"/v1/databases/([^/]+)(/query)?", path)
+        if match:
+            database_id, query = match.groups()
+            if query and method == "POST":
+                return self.query(database_id, body)
+            if not query and method == "GET" and database_id in self.databases:
+                return 200, self.databases[database_id]
+        if method == "POST" and path == "/v1/pages":
+            return self.create_page(body)
+        match = re.fullmatch(r"/v1/pages/([^/]+)", path)
+        if match:
+            if method == "PATCH":
+                return self.update_page(match.group(1), body)
+            if method == "GET" and match.group(1) in self.pages:
+                return 200, self.pages[match.group(1)]
+        return 404, {"object": "error", "status": 404, "code": "object_not_found"}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, like the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, status : int, body : dict, headers : dict = None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self, method : str):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length > 0 else b""
+                if fake.latency > 0 or fake.jitter > 0:
+                    sleep(fake.latency + random.uniform(0, fake.jitter))
+                if fake._throttled():
+                    self._respond(429, {"object": "error", "status": 429, "code": "rate_limited"}, {"Retry-After": str(fake.retry_after)})
+                    return
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    self._respond(400, {"object": "error", "status": 400, "code": "invalid_json"})
+                    return
+                status, response = fake.route(method, self.path.split("?")[0], body)
+                self._respond(status, response)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Notion API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--databases", type=int, default=1)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeNotion(args.port, args.databases, args.rows, args.latency, args.jitter, args.rate_limit, args.error_rate)
+    print(f"Fake Notion API at {fake.base_url}")
+    for database_id in fake.databases:
+        print(f"  database {database_id}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from anki.lang import _
 from aqt import mw, utils
 from aqt.qt import *
 from .model.model import model
+from .model.startup import startup_timer
 from gui.download import Ui_download
 from gui.upload import Ui_upload
 from gui.settings import Ui_settings
@@ -18,39 +19,58 @@ class Gui_Manager():
         # Boilerplate to hook up the GUI
         # -------------------------------
         # GUIs are tuples: [0] GUI setup class from QT creator, [1] Class to use
-        self.dialog_gui_classes = {"Upload": (Ui_upload(), Upload_Dialog), "Download": (Ui_download(), Download_Dialog), "Settings": (Ui_settings(), Settings_Dialog)}
+        # Dialogs are only built the first time they're shown, so profile load doesn't pay for them.
+        self.dialog_gui_classes = {"Upload": (Ui_upload, Upload_Dialog), "Download": (Ui_download, Download_Dialog), "Settings": (Ui_settings, Settings_Dialog)}
         self.dialogs = {}
-        for k in self.dialog_gui_classes:
-            cur_custom_class = self.dialog_gui_classes[k][1]
-            cur_gui_obj = self.dialog_gui_classes[k][0]
-            self.dialogs[k] = cur_custom_class()
-            cur_gui_obj.setupUi(self.dialogs[k])
-            self.dialogs[k].setup_gui(cur_gui_obj)
-            self.dialogs[k].setup_actions(cur_gui_obj)
+        self.forms = {}
+        self.test_menu_loaded = False
         # ------------------------------
         # Boilerplate ends here
         # ------------------------------
 
+    def get_dialog(self, k):
+        if k not in self.dialogs:
+            with startup_timer.phase(f"build {k} dialog"):
+                cur_gui_obj = self.dialog_gui_classes[k][0]()
+                cur_custom_class = self.dialog_gui_classes[k][1]
+                self.dialogs[k] = cur_custom_class()
+                self.forms[k] = cur_gui_obj
+                cur_gui_obj.setupUi(self.dialogs[k])
+                self.dialogs[k].setup_actions(cur_gui_obj)
+        return self.dialogs[k], self.forms[k]
+
     def load_menu(self):
-        for k in self.dialogs:
-            add_menu_item("anki2notion",k,self.show_form_factory(self.dialogs[k], self.dialog_gui_classes[k][0]))
+        for k in self.dialog_gui_classes:
+            add_menu_item("anki2notion",k,self.show_form_factory(k))
+        # the show_tests check reads the config, so it waits until the menu is first opened rather than profile load
+        mw.custom_menus["anki2notion"].aboutToShow.connect(self.load_test_menu)
+
+    def load_test_menu(self):
+        if self.test_menu_loaded:
+            return
+        self.test_menu_loaded = True
         if model.config["show_tests"]:
             add_menu_item("anki2notion::Tests","Get Databases",self.test_get_databases)
             add_menu_item("anki2notion::Tests","Get Records",self.test_get_records)
+            add_menu_item("anki2notion::Tests","Startup Timings",self.show_startup_timings)
 
     def unload_menus(self):
+        self.test_menu_loaded = False
         for menu in mw.custom_menus.values():
             mw.form.menubar.removeAction(menu.menuAction())
         mw.custom_menus.clear()
 
-    def show_form_factory(self, dialog, form):
-        return lambda: self.show_form_template(dialog, form)
+    def show_form_factory(self, k):
+        return lambda: self.show_form_template(*self.get_dialog(k))
 
     def show_form_template(self, dialog, form):
         dialog.setup_gui(form)
         dialog.setup_actions(form)
         dialog.exec()
     
+    def show_startup_timings(self):
+        utils.showText(startup_timer.report())
+
     def test_get_databases(self):
         types = model.sync.get_anki_card_types()
         utils.showInfo( str(types[0]) )
@@ -82,21 +102,228 @@ class a2n_Dialog(QDialog):
     def setup_gui(self, form):
         pass
 
-class Upload_Dialog(a2n_Dialog):
-    def _setup_actions(self, form):
-        form.cancel_button.clicked.connect(lambda: close_form(self))
-        super().setup_actions(form)
+class Sync_Dialog(a2n_Dialog):
+    '''Base for the Upload and Download dialogs: runs a SyncJob in the background and shows its progress.'''
+    progress_verb = "Synced"
+    # name of the form's button that starts the sync
+    sync_button_name = "sync_button"
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.job = None
+
+    def sync_button(self, form):
+        return getattr(form, self.sync_button_name)
+
+    def make_job(self, form):
+        # subclasses build the job; without one nothing is started
+        return None
+
+    def notion_reader(self, trace = None):
+        # core's Notion classes take no trace, so calls are timed by wrapping them
+        from core.sync.sync_notion import NotionReader
+        from .model.instrument import traced
+        reader = NotionReader({"notion_key": model.get_notion_key()})
+        return traced(reader, trace, "notion") if trace != None else reader
+
+    def notion_tables(self) -> list:
+        from core.sync.sync_types import DATA_SOURCE
+        from .model.metadata_cache import cached_tables
+        try:
+            return cached_tables(self.notion_reader(), DATA_SOURCE.NOTION)
+        except Exception as e:
+            # no key yet, or Notion unreachable; the dialog still opens
+            utils.showWarning(f"Couldn't list Notion databases: {e}")
+            return []
+
+    def make_trace(self):
+        # with trace_syncs on, every run's per-stage timings are written to sync_trace.json
+        from .model.instrument import SyncTrace, NULL_TRACE
+        if not model.config["trace_syncs"]:
+            return NULL_TRACE, None
+        return SyncTrace(), join(dirname(realpath(__file__)), 'sync_trace.json')
 
     def setup_gui(self, form):
         form.sync_mode.setCurrentIndex( model.get_merge_mode() )
+        self.show_progress(form, 0, 0)
+        from .model.sync_anki import AnkiReader
+        form.anki_card_type_select.clear()
+        for table in AnkiReader({}).get_tables():
+            form.anki_card_type_select.addItem(table.name, table)
+        form.anki_deck_select.clear()
+        form.anki_deck_select.addItem("<All Decks>", None)
+        for deck in AnkiReader({}).get_decks():
+            form.anki_deck_select.addItem(deck.name, deck.id)
+        form.notion_database_select.clear()
+        for table in self.notion_tables():
+            form.notion_database_select.addItem(table.name, table)
+        self.fill_primary_keys(form)
 
-class Download_Dialog(a2n_Dialog):
     def _setup_actions(self, form):
-        form.cancel_button.clicked.connect(lambda: close_form(self))
+        form.cancel_button.clicked.connect(lambda: self.cancel(form))
+        self.sync_button(form).clicked.connect(lambda: self.start_sync(form))
+        form.anki_card_type_select.currentIndexChanged.connect(lambda: self.fill_primary_keys(form))
+        form.notion_database_select.currentIndexChanged.connect(lambda: self.fill_primary_keys(form))
         super().setup_actions(form)
 
-    def setup_gui(self, form):
-        form.sync_mode.setCurrentIndex( model.get_merge_mode() )
+    def fill_primary_keys(self, form):
+        # keys have to be columns on both sides; without a Notion database, every Anki field is offered
+        from core.sync.sync_types import DATA_SOURCE
+        from .model.sync_anki import AnkiReader
+        from .model.metadata_cache import cached_columns
+        form.primary_key.clear()
+        table = form.anki_card_type_select.currentData()
+        if table == None:
+            return
+        notion_names = None
+        notion_table = form.notion_database_select.currentData()
+        if notion_table != None:
+            reader = self.notion_reader()
+            reader.set_table(notion_table)
+            try:
+                notion_names = set( col.name for col in cached_columns(reader, DATA_SOURCE.NOTION) )
+            except Exception:
+                pass # Notion unreachable; fall back to every Anki field
+        for col in AnkiReader({"table": table}).get_columns():
+            if notion_names == None or col.name in notion_names:
+                form.primary_key.addItem(col.name)
+
+    def confirm_from_worker(self, message : str) -> bool:
+        '''Ask the user from a background job, blocking the job until they answer.'''
+        from threading import Event
+        answered = Event()
+        answer = []
+        def ask():
+            answer.append(utils.askUser(message, parent=self))
+            answered.set()
+        mw.taskman.run_on_main(ask)
+        answered.wait()
+        return answer[0]
+
+    def cancel(self, form):
+        if self.job != None:
+            self.job.cancel()
+        else:
+            close_form(self)
+
+    def start_sync(self, form):
+        if self.job != None:
+            return
+        job = self.make_job(form)
+        if job == None:
+            return
+        self.job = job
+        self.sync_button(form).setEnabled(False)
+        # progress is posted back to the main thread; SyncJob throttles how often it reports
+        on_progress = lambda done, total: mw.taskman.run_on_main(lambda: self.show_progress(form, done, total))
+        mw.taskman.run_in_background(lambda: job.run(on_progress), lambda fut: self.sync_finished(form, fut))
+
+    def sync_finished(self, form, fut):
+        self.job = None
+        self.sync_button(form).setEnabled(True)
+        try:
+            rows = fut.result()
+        except Exception as e:
+            utils.showWarning(f"Sync failed: {e}")
+            return
+        utils.tooltip(f"{rows} rows {self.progress_verb.lower()}.")
+
+    def show_progress(self, form, done, total):
+        if total < 0:
+            # unknown total: busy indicator
+            form.progress_bar.setRange(0, 0)
+            form.progress_label.setText(f"{done} {self.progress_verb}")
+        else:
+            form.progress_bar.setRange(0, max(total, 1))
+            form.progress_bar.setValue(done)
+            form.progress_label.setText(f"{done}/{total} {self.progress_verb}")
+
+class Upload_Dialog(Sync_Dialog):
+    progress_verb = "Uploaded"
+    sync_button_name = "upload_button"
+
+    def make_job(self, form):
+        anki_table = form.anki_card_type_select.currentData()
+        notion_table = form.notion_database_select.currentData()
+        if anki_table == None or notion_table == None:
+            utils.showInfo("Select an Anki card type and a Notion database first.")
+            return None
+        from .model.dataset_index import APPEND
+        if form.sync_mode.currentIndex() != APPEND:
+            # NotionWriter only creates pages, so merging into a database isn't supported yet
+            utils.showInfo("Uploads to Notion can only append for now; set the sync mode to Append.")
+            return None
+        from .model.sync_anki import AnkiReader, NOTE_ID
+        from .model.sync_job import SyncJob
+        from .model.notion_pages import NotionPageWriter
+        from .model.notion_transport import NotionTransport
+        from .model.id_map import IdMap
+        from .model.snapshot import KEY_INT, SnapshotBuilder, snapshot_path
+        trace, trace_path = self.make_trace()
+        # with parallel_clean on, large note types are cleaned across a process pool, a page split between the workers
+        reader_parameters = {"table": anki_table, "trace": trace, "parallel": bool(model.config["parallel_clean"]), "include_ids": True}
+        deck_only = form.anki_deck_select.currentData() != None
+        if deck_only:
+            reader_parameters["deck_name"] = form.anki_deck_select.currentText()
+        reader = AnkiReader(reader_parameters)
+        # uploads can only append, so the notes already sent to this database (the last upload's snapshot, by note id)
+        # are skipped; a deck's upload is merged into the note type's snapshot rather than replacing it
+        snapshot = SnapshotBuilder(snapshot_path(anki_table, target = notion_table), NOTE_ID, key_kind = KEY_INT, merge = deck_only)
+        # pages are created several at a time on the pooled, rate limited transport, which times each call.
+        # Each new page is paired with its note, and notes already paired (downloaded from Notion) aren't sent back.
+        id_map = IdMap(anki_table.parameters["id"], notion_table.parameters["id"])
+        writer = NotionPageWriter({"transport": NotionTransport(model.get_notion_key(), trace = trace), "trace": trace, "id_map": id_map, "id_column": NOTE_ID})
+        writer.set_table(notion_table)
+        return SyncJob(reader, writer, page_size = 2000, trace = trace, trace_path = trace_path, snapshot = snapshot, only_added = True)
+
+class Download_Dialog(Sync_Dialog):
+    progress_verb = "Downloaded"
+    sync_button_name = "download_button"
+
+    def make_job(self, form):
+        anki_table = form.anki_card_type_select.currentData()
+        notion_table = form.notion_database_select.currentData()
+        if anki_table == None or notion_table == None:
+            utils.showInfo("Select a Notion database and an Anki card type first.")
+            return None
+        from .model.sync_anki import AnkiWriter
+        from .model.pipeline import StreamingSync
+        from .model.journal import SyncJournal
+        from .model.sync_job import MergeJob
+        from .model.dataset_index import APPEND, HARD_MERGE
+        from .model.incremental import IncrementalSync
+        from .model.notion_pages import NotionPageReader, PAGE_ID
+        from .model.notion_transport import NotionTransport
+        from .model.id_map import IdMap
+        trace, trace_path = self.make_trace()
+        append = form.sync_mode.currentIndex() == APPEND
+        # after the first download only pages edited since the last one are read; hard merges read every page,
+        # since a note is only deleted once its page is known to be gone
+        watermark = IncrementalSync(model.config, anki_table.parameters["id"], notion_table.parameters.get("id"))
+        edited_filter = watermark.notion_filter() if form.sync_mode.currentIndex() != HARD_MERGE else None
+        reader = NotionPageReader({"transport": NotionTransport(model.get_notion_key(), trace = trace), "filter": edited_filter, "trace": trace, "include_ids": True})
+        reader.set_table(notion_table)
+        # appends clean each page in the pipeline's transform stage and skip notes already there; merges clean as they
+        # join and prepare the rows they append, so neither cleans on write
+        # each note written is paired with its page; merges update paired notes directly, appends skip pages already paired
+        id_map = IdMap(anki_table.parameters["id"], notion_table.parameters["id"])
+        writer = AnkiWriter({"trace": trace, "pre_cleaned": True, "dedup": append, "id_map": id_map, "id_column": PAGE_ID})
+        writer.set_table(anki_table)
+        if not append:
+            if form.primary_key.currentText() == "":
+                utils.showInfo("Select a primary key to merge on first.")
+                return None
+            # hard merges show how many notes will go before anything is deleted
+            confirm = lambda count: self.confirm_from_worker(f"Hard Merge will delete {count} notes from {anki_table.name}. Continue?")
+            return MergeJob(reader, writer, form.primary_key.currentText(), form.sync_mode.currentIndex(), trace = trace, trace_path = trace_path, confirm_delete = confirm, columnar = True, watermark = watermark)
+        # an interrupted download of the same database into the same note type picks up after the last page it
+        # wrote, from Notion's cursor for the next page
+        from core.sync.sync_notion import NotionSyncHandle
+        from core.sync.sync_types import DATA_SOURCE
+        journal = SyncJournal(f"download-{notion_table.parameters.get('id')}-{anki_table.parameters['id']}")
+        resume = lambda cursor: NotionSyncHandle(None, DATA_SOURCE.NOTION, cursor, False)
+        # Notion page fetches overlap with Anki writes
+        return StreamingSync(reader, writer, transform = writer.prepare, trace = trace, trace_path = trace_path, journal = journal, watermark = watermark, resume = resume)
 
 class Settings_Dialog(a2n_Dialog):
     def _setup_actions(self, form):
@@ -111,6 +338,9 @@ class Settings_Dialog(a2n_Dialog):
     def save_key(self, form):
         model.save_merge_mode(form.merge_mode.currentIndex())
         model.save_notion_key(form.api_key.text())
+        # a new key can mean a different Notion workspace
+        from .model.metadata_cache import schema_cache
+        schema_cache.invalidate()
         self.close()
 
 def close_form(form):
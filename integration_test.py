@@ -3,13 +3,15 @@ from json import dump, dumps, load
 import json
 import requests
 from core.sync.sync_notion import *
-
-class BearerAuth(requests.auth.AuthBase):
-    def __init__(self, token):
-        self.token = token
-    def __call__(self, r):
-        r.headers["authorization"] = "Bearer " + self.token
-        return r
+from model.notion_transport import BearerAuth, NotionTransport, TokenBucket, concurrent_map
+from model.incremental import IncrementalSync
+from model.notion_pages import NotionPageReader, NotionPageWriter
+from model import id_map
+from fake_notion import FakeNotion
+from os.path import join
+import sys
+import tempfile
+import time
 
 def test_notion_get_databases(config):
     nr = NotionReader()
@@ -39,6 +41,89 @@ def test_notion_get_records(config) -> DataSet:
         it += 1
     return DataSet(column_info, record_set, None)
 
+def test_fake_notion_pagination(rows = 250):
+    # offline: reads a whole database from the local fake through start_cursor / has_more
+    with FakeNotion(rows=rows) as fake:
+        transport = NotionTransport("fake-key", fake.base_url, TokenBucket(1000, 1000))
+        database_id = next(iter(fake.databases))
+        pages = list(transport.iter_database(database_id))
+        assert len(pages) == rows, f"expected {rows} pages, got {len(pages)}"
+        created = transport.create_page(database_id, {"Name": {"title": [{"text": {"content": "New"}}]}})
+        transport.update_page(created["id"], archived=True)
+        return len(pages)
+
+def test_fake_notion_rate_limit(requests_made = 12):
+    # offline: concurrent writers against a 3 req/s limit with injected 429s all succeed through retries
+    with FakeNotion(rows=0, rate_limit=3, error_rate=0.1, retry_after=0.2) as fake:
+        transport = NotionTransport("fake-key", fake.base_url, TokenBucket(3, 1), backoff_base=0.1)
+        database_id = next(iter(fake.databases))
+        start = time.perf_counter()
+        concurrent_map(lambda n: transport.create_page(database_id, {"Name": {"title": [{"text": {"content": str(n)}}]}}), range(requests_made))
+        elapsed = time.perf_counter() - start
+        assert len(fake._database_pages(database_id)) == requests_made
+        return {"seconds": round(elapsed, 2), "requests": fake.request_count, "rate_limited": fake.rate_limited_count}
+
+def test_fake_notion_upload(rows = 20):
+    # offline: NotionPageWriter creates a page per record through the transport, leaving out non-properties,
+    # and pairs each with its note so a second upload of the same notes creates nothing
+    with FakeNotion(rows=0, rate_limit=3, error_rate=0.1, retry_after=0.2) as fake, tempfile.TemporaryDirectory() as directory:
+        transport = NotionTransport("fake-key", fake.base_url, TokenBucket(3, 1), backoff_base=0.1)
+        database_id = next(iter(fake.databases))
+        map_path = join(directory, "id_map.sqlite")
+        columns = [ DataColumn(COLUMN_TYPE.TEXT, "Name"), DataColumn(COLUMN_TYPE.MULTI_SELECT, "Tags"), DataColumn(COLUMN_TYPE.TEXT, "Back"), DataColumn(COLUMN_TYPE.TEXT, "note_id") ]
+        records = [ {"Name": f"Note {n}", "Tags": ["a", "b"], "Back": "not a property", "note_id": n} for n in range(rows) ]
+        writer = NotionPageWriter({"transport": transport, "id_map": id_map.IdMap(1, database_id, map_path), "id_column": "note_id"})
+        writer.set_table(TableSpec(DATA_SOURCE.NOTION, {"id": database_id}, "Database 0"))
+        for _ in range(2):
+            handle = writer.write_records_sync(DataSet(columns, records), 8)
+            while not handle.done:
+                handle = writer.write_records_sync(DataSet(columns, records), 8, handle)
+        id_map.close(map_path)
+        pages = fake._database_pages(database_id)
+        assert len(pages) == rows, f"expected {rows} pages, got {len(pages)}"
+        assert all( "Back" not in page["properties"] for page in pages )
+        return {"pages": len(pages), "rate_limited": fake.rate_limited_count}
+
+class _MemoryConfig():
+    def __init__(self):
+        self.state = {}
+    def get_watermark(self, note_type_id, database_id):
+        return self.state.get((note_type_id, database_id))
+    def save_watermark(self, note_type_id, database_id, watermark):
+        self.state[(note_type_id, database_id)] = watermark
+
+def test_fake_notion_incremental():
+    # offline: after the first download, only pages edited since the saved watermark are read
+    config = _MemoryConfig()
+    with FakeNotion(rows=5) as fake:
+        for page in fake.pages.values():
+            page["last_edited_time"] = "2020-01-01T00:00:00.000Z"
+        transport = NotionTransport("fake-key", fake.base_url, TokenBucket(1000, 1000))
+        database_id = next(iter(fake.databases))
+        table = TableSpec(DATA_SOURCE.NOTION, {"id": database_id}, "Database 0")
+        def read(watermark):
+            reader = NotionPageReader({"transport": transport, "filter": watermark.notion_filter()})
+            reader.set_table(table)
+            handle = reader.read_records_sync(2)
+            rows = len(handle.records.records)
+            while not handle.done:
+                handle = reader.read_records_sync(2, handle)
+                rows += len(handle.records.records)
+            return rows
+        first = IncrementalSync(config, 1, database_id)
+        assert read(first) == 5, "first download must read everything"
+        first.save()
+        assert read(IncrementalSync(config, 1, database_id)) == 0
+        transport.update_page(next(iter(fake.pages)), {})
+        assert read(IncrementalSync(config, 1, database_id)) == 1
+        return True
+
+def main_offline():
+    print(f"Pagination: read {test_fake_notion_pagination()} pages")
+    print(f"Rate limit: {test_fake_notion_rate_limit()}")
+    print(f"Upload: {test_fake_notion_upload()}")
+    print(f"Incremental: {test_fake_notion_incremental()}")
+
 def main():
     fh = open("./config.json", "r")
     config = load(fh)
@@ -49,4 +134,7 @@ def main():
     print(json.dumps(records.records, indent = 4))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--offline" in sys.argv:
+        main_offline()
+    else:
+        main()
\ No newline at end of file
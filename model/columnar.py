@@ -0,0 +1,151 @@
+import sys
+from core.sync.sync_types import *
+
+# Column-oriented alternative to DataSet for large tables. Each column is one list, select values
+# are interned and multiselect values share one tuple per distinct combination, so a 100k row table
+# no longer pays a dict (and a copy of every column name) per row. Rows are read through small
+# __slots__ views with the same asdict() as DataRecord, and anything that needs a core DataSet
+# (make_write_safe, the other sync modules) gets one through to_dataset().
+
+# placeholder for keys a record didn't have, so asdict() leaves them out again
+_MISSING = object()
+
+class RowView():
+    '''One row of a ColumnarDataSet, read in place.'''
+    __slots__ = ("_dataset", "_row")
+
+    def __init__(self, dataset, row : int):
+        self._dataset = dataset
+        self._row = row
+
+    def __getitem__(self, name : str):
+        value = self._dataset._data[name][self._row]
+        if value is _MISSING:
+            raise KeyError(name)
+        return self._dataset._out(name, value)
+
+    def get(self, name : str, default = None):
+        values = self._dataset._data.get(name)
+        if values == None or values[self._row] is _MISSING:
+            return default
+        return self._dataset._out(name, values[self._row])
+
+    def asdict(self) -> dict:
+        dataset = self._dataset
+        row = self._row
+        out = {}
+        for name, values in dataset._data.items():
+            value = values[row]
+            if value is not _MISSING:
+                out[name] = dataset._out(name, value)
+        return out
+
+    def __eq__(self, other):
+        if isinstance(other, RowView):
+            other = other.asdict()
+        elif hasattr(other, "asdict"):
+            other = other.asdict()
+        return self.asdict() == other
+
+    def __repr__(self):
+        return f"RowView({self.asdict()!r})"
+
+class _Rows():
+    '''Sequence of RowViews standing in for DataSet.records.'''
+    __slots__ = ("_dataset",)
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+
+    def __len__(self):
+        return self._dataset._length
+
+    def __getitem__(self, index):
+        length = self._dataset._length
+        if isinstance(index, slice):
+            return [ RowView(self._dataset, row) for row in range(*index.indices(length)) ]
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError("row index out of range")
+        return RowView(self._dataset, index)
+
+    def __iter__(self):
+        dataset = self._dataset
+        return ( RowView(dataset, row) for row in range(dataset._length) )
+
+class ColumnarDataSet():
+    '''DataSet stored column by column; same columns / column_names / records / add_records / drop_column.'''
+    def __init__(self, columns : list, records : list = None):
+        self.columns = list(columns)
+        # column name (plus any extra record keys, such as Anki's tags) -> one value per row
+        self._data = { column.name: [] for column in self.columns }
+        self._select = set( column.name for column in self.columns if column.type == COLUMN_TYPE.SELECT )
+        self._multi_select = set( column.name for column in self.columns if column.type == COLUMN_TYPE.MULTI_SELECT )
+        # one shared tuple per distinct multiselect combination
+        self._combinations = {}
+        self._length = 0
+        if records != None:
+            self.add_records(records)
+
+    @property
+    def column_names(self) -> list:
+        return [ column.name for column in self.columns ]
+
+    @property
+    def records(self) -> _Rows:
+        return _Rows(self)
+
+    def __len__(self):
+        return self._length
+
+    def _in(self, name : str, value):
+        if value == None:
+            return None
+        if name in self._select and isinstance(value, str):
+            return sys.intern(value)
+        if name in self._multi_select and isinstance(value, (list, tuple)):
+            key = tuple( sys.intern(v) if isinstance(v, str) else v for v in value )
+            return self._combinations.setdefault(key, key)
+        return value
+
+    def _out(self, name : str, value):
+        # multiselect values go back out as fresh lists, like DataRecord's
+        if name in self._multi_select and isinstance(value, tuple):
+            return list(value)
+        return value
+
+    def add_records(self, records : list):
+        '''Append records (dicts or anything with asdict()).'''
+        data = self._data
+        for record in records:
+            if hasattr(record, "asdict"):
+                record = record.asdict()
+            for name in record:
+                if name not in data:
+                    data[name] = [_MISSING] * self._length
+            for name, values in data.items():
+                values.append(self._in(name, record[name]) if name in record else _MISSING)
+            self._length += 1
+
+    def drop_column(self, column_name : str):
+        if column_name not in self._data:
+            raise KeyError(f"Can't drop {column_name}; it isn't a column of the dataset.")
+        del self._data[column_name]
+        self.columns = [ column for column in self.columns if column.name != column_name ]
+        self._select.discard(column_name)
+        self._multi_select.discard(column_name)
+
+    def column_values(self, column_name : str) -> list:
+        '''All values of one column, without building any rows.'''
+        return [ None if value is _MISSING else self._out(column_name, value) for value in self._data[column_name] ]
+
+    def to_dataset(self) -> DataSet:
+        return DataSet(self.columns, [ record.asdict() for record in self.records ])
+
+    @staticmethod
+    def from_dataset(dataset):
+        return ColumnarDataSet(dataset.columns, dataset.records)
+
+    def make_write_safe(self, type_clean : dict):
+        return self.to_dataset().make_write_safe(type_clean)
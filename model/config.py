@@ -23,19 +23,35 @@ from json import dump, load
 from os.path import dirname, exists, join, realpath
 
 from aqt import mw
+from .startup import startup_timer
 
 class ConfigManager:
     default_path = join(dirname(realpath(__file__)), 'config.json')
     saved_path = join(dirname(realpath(__file__)), 'config_saved.json')
+    # per (note type, Notion database) watermarks for incremental syncs
+    sync_state_path = join(dirname(realpath(__file__)), 'sync_state.json')
 
-    with open(default_path, encoding='utf-8') as f:
-        config = defaultdict(str, load(f))
+    # read on first access rather than at import, and shared by all instances
+    _config = None
 
-    if exists(saved_path):
-        with open(saved_path, encoding='utf-8') as f:
-            config_saved = defaultdict(str, load(f))
-        if config_saved['version'] == config['version']:
-            config = config_saved
+    @classmethod
+    def _load(cls):
+        with startup_timer.phase("load config"):
+            with open(cls.default_path, encoding='utf-8') as f:
+                config = defaultdict(str, load(f))
+
+            if exists(cls.saved_path):
+                with open(cls.saved_path, encoding='utf-8') as f:
+                    config_saved = defaultdict(str, load(f))
+                if config_saved['version'] == config['version']:
+                    config = config_saved
+        cls._config = config
+
+    @property
+    def config(self):
+        if ConfigManager._config is None:
+            self._load()
+        return ConfigManager._config
 
     def __setitem__(self, key, value):
         self.config[key] = value
@@ -62,3 +78,24 @@ class ConfigManager:
 
     def get_config_scalar_value(self, keyName):
         return self.config[keyName] if keyName in self.config else None
+
+    def _load_sync_state(self):
+        if not exists(self.sync_state_path):
+            return {}
+        with open(self.sync_state_path, encoding='utf-8') as f:
+            return load(f)
+
+    def get_watermark(self, note_type_id, database_id):
+        return self._load_sync_state().get(f"{note_type_id}:{database_id}")
+
+    def save_watermark(self, note_type_id, database_id, watermark: dict):
+        state = self._load_sync_state()
+        state[f"{note_type_id}:{database_id}"] = watermark
+        with open(self.sync_state_path, 'w', encoding='utf-8') as f:
+            dump(state, f)
+
+    def clear_watermark(self, note_type_id, database_id):
+        state = self._load_sync_state()
+        state.pop(f"{note_type_id}:{database_id}", None)
+        with open(self.sync_state_path, 'w', encoding='utf-8') as f:
+            dump(state, f)
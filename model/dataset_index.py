@@ -0,0 +1,102 @@
+# Optional hash indexing for DataSets, and the merge built on it.
+# DataSet itself lives in core; the index sits alongside it and is kept up to date by routing
+# add_records / drop_column through the index.
+
+# same values as the dialogs' sync_mode combo and sync/MERGE_TYPE
+APPEND = 0
+SOFT_MERGE = 1
+HARD_MERGE = 2
+
+def _hashable(value):
+    # multiselect values are lists
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+class DataSetIndex():
+    '''Hash index from the values of one column to the row positions holding them.'''
+    def __init__(self, dataset, column_name : str):
+        if column_name not in dataset.column_names:
+            raise KeyError(f"Can't index on {column_name}; it isn't a column of the dataset.")
+        self.dataset = dataset
+        self.column_name = column_name
+        self.index = None
+        self.build()
+
+    def build(self):
+        self.index = {}
+        self._index_rows(0)
+
+    def _index_rows(self, start : int):
+        if hasattr(self.dataset, "column_values"):
+            # ColumnarDataSets hand over the column without building rows
+            values = self.dataset.column_values(self.column_name)[start:]
+        else:
+            records = self.dataset.records
+            values = [ records[row].asdict()[self.column_name] for row in range(start, len(records)) ]
+        for row, value in enumerate(values, start):
+            key = _hashable(value)
+            if key in self.index:
+                self.index[key].append(row)
+            else:
+                self.index[key] = [row]
+
+    def get(self, key) -> list:
+        '''Row positions holding key, in dataset order.'''
+        if self.index == None:
+            raise KeyError(f"Index on {self.column_name} was dropped along with its column.")
+        return self.index.get(_hashable(key), [])
+
+    def __contains__(self, key) -> bool:
+        return len(self.get(key)) > 0
+
+    def keys(self):
+        return self.index.keys()
+
+    def add_records(self, records : list):
+        start = len(self.dataset.records)
+        result = self.dataset.add_records(records)
+        if self.index != None:
+            self._index_rows(start)
+        return result
+
+    def drop_column(self, column_name : str):
+        result = self.dataset.drop_column(column_name)
+        if column_name == self.column_name:
+            self.index = None
+        return result
+
+def indexed_merge(left, right, primary_key : str, merge_mode = SOFT_MERGE, right_index : DataSetIndex = None):
+    '''Merge left (source) into right (destination) by primary_key in O(n+m).
+
+    Append concatenates. Soft merge updates matched right rows with left's values, appends unmatched left
+    rows and keeps right-only rows. Hard merge does the same but drops right-only rows.
+    Returns a new dataset with right's columns.'''
+    merge_mode = getattr(merge_mode, "value", merge_mode)
+    column_names = right.column_names
+    left_rows = [ record.asdict() for record in left.records ]
+    right_rows = [ record.asdict() for record in right.records ]
+
+    if merge_mode == APPEND:
+        merged = right_rows + [ { k: row.get(k) for k in column_names } for row in left_rows ]
+        return type(right)(right.columns, merged)
+
+    if right_index == None or right_index.index == None or right_index.column_name != primary_key:
+        right_index = DataSetIndex(right, primary_key)
+
+    matched = [False] * len(right_rows)
+    appended = []
+    for row in left_rows:
+        positions = right_index.get(row.get(primary_key))
+        if len(positions) == 0:
+            appended.append({ k: row.get(k) for k in column_names })
+            continue
+        for pos in positions:
+            matched[pos] = True
+            for k in column_names:
+                if k in row:
+                    right_rows[pos][k] = row[k]
+
+    if merge_mode == HARD_MERGE:
+        right_rows = [ row for pos, row in enumerate(right_rows) if matched[pos] ]
+    return type(right)(right.columns, right_rows + appended)
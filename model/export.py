@@ -0,0 +1,97 @@
+import json
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+
+# Streaming export of a table to TSV or JSON lines. Pages flow from the reader through a generator
+# straight into the file, so memory use is one page regardless of the size of the table.
+
+FLUSH_ROWS = 1000
+FILE_BUFFER = 1 << 20
+
+def iter_pages(reader, page_size : int = 1000):
+    '''Yield each page of records from reader as a DataSet.'''
+    it = reader.read_records_sync(page_size)
+    yield it.records
+    while not it.done:
+        it = reader.read_records_sync(page_size, it)
+        yield it.records
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+class StreamWriter(ABC):
+    '''Writes rows to path, joining them into one write every flush_rows rows.'''
+    def __init__(self, path : str, flush_rows : int = FLUSH_ROWS):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.buffer = []
+        self.rows = 0
+        self.file = None
+        self.columns = None
+
+    def __enter__(self):
+        self.file = open(self.path, "w", encoding="utf-8", newline="", buffering=FILE_BUFFER)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+        self.file.close()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.file.write("".join(self.buffer))
+            self.buffer = []
+
+    def write_page(self, page):
+        if self.columns == None:
+            self.columns = list(page.column_names)
+            # Anki records carry tags without a tags column
+            if len(page.records) > 0:
+                self.columns.extend(k for k in page.records[0].asdict() if k not in self.columns)
+            self._write_header()
+        for record in page.records:
+            self.buffer.append(self._format(record.asdict()))
+            self.rows += 1
+            if len(self.buffer) >= self.flush_rows:
+                self.flush()
+
+    def _write_header(self):
+        pass
+
+    @abstractmethod
+    def _format(self, record : dict) -> str:
+        '''One output line for record.'''
+
+class TsvStreamWriter(StreamWriter):
+    def _write_header(self):
+        self.buffer.append("\t".join(self._cell(name) for name in self.columns) + "\n")
+
+    def _cell(self, value) -> str:
+        if value == None:
+            return ""
+        if isinstance(value, list):
+            value = ",".join(str(v) for v in value)
+        elif isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        # tabs and newlines would break the row structure
+        return str(value).replace("\t", " ").replace("\r", " ").replace("\n", " ")
+
+    def _format(self, record : dict) -> str:
+        return "\t".join(self._cell(record.get(name)) for name in self.columns) + "\n"
+
+class JsonLinesStreamWriter(StreamWriter):
+    def _format(self, record : dict) -> str:
+        return json.dumps(record, default=_json_default, ensure_ascii=False) + "\n"
+
+WRITERS = {"tsv": TsvStreamWriter, "jsonl": JsonLinesStreamWriter}
+
+def export_table(reader, path : str, format : str = "tsv", page_size : int = 1000) -> int:
+    '''Export everything reader reads to path; returns the number of rows written.'''
+    if format not in WRITERS:
+        raise ValueError(f"Unknown export format {format}; expected one of {', '.join(WRITERS)}.")
+    with WRITERS[format](path) as writer:
+        for page in iter_pages(reader, page_size):
+            writer.write_page(page)
+    return writer.rows
@@ -0,0 +1,39 @@
+from functools import lru_cache
+from html import unescape
+import re
+
+# Plain-text extraction for Anki field values.
+# Fields are read for every note on every upload, so this is kept to precompiled patterns
+# and a memo for the (very common) repeated values.
+
+CACHE_SIZE = 4096
+
+_BLOCK_TAG = re.compile(r"<\s*(?:br|/?(?:div|p|li|tr|h[1-6]|ul|ol|table|blockquote))\b[^>]*>", re.IGNORECASE)
+_DROP_TAG = re.compile(r"<\s*(script|style)\b[^>]*>.*?<\s*/\s*\1\s*>", re.IGNORECASE | re.DOTALL)
+_ANY_TAG = re.compile(r"<[^>]*>")
+_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_EXTRA_NEWLINES = re.compile(r"\n{2,}")
+
+def html_to_text(string: str) -> str:
+    '''Strip tags, decode entities and turn block tags into newlines.'''
+    if string is None:
+        return string
+    # fast path: nothing to strip or decode
+    if "<" not in string and "&" not in string:
+        return string
+    return _html_to_text_cached(string)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _html_to_text_cached(string: str) -> str:
+    if "<" in string:
+        string = _COMMENT.sub("", string)
+        string = _DROP_TAG.sub("", string)
+        string = _BLOCK_TAG.sub("\n", string)
+        string = _ANY_TAG.sub("", string)
+        string = _EXTRA_NEWLINES.sub("\n", string).strip("\n")
+    if "&" in string:
+        string = unescape(string).replace("\xa0", " ")
+    return string
+
+def clear_cache():
+    _html_to_text_cached.cache_clear()
@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+from os.path import dirname, join, realpath
+from time import time
+
+# Persistent Notion page id <-> Anki note id mapping, one SQLite file next to config_saved.json.
+# Writers record pairs as they write, in one transaction per batch, so later syncs can route a
+# changed row straight to its counterpart instead of joining full datasets on a primary key.
+
+default_path = join(dirname(realpath(__file__)), 'id_map.sqlite')
+
+_SCHEMA = [
+    """create table if not exists id_map (
+        note_type_id integer not null,
+        database_id text not null,
+        page_id text not null,
+        note_id integer not null,
+        updated real not null,
+        primary key (note_type_id, database_id, page_id)
+    )""",
+    "create unique index if not exists id_map_note on id_map (note_type_id, database_id, note_id)"
+]
+
+# sqlite's limit on host parameters is 999 in older builds
+_BATCH = 900
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+def _connect(path : str):
+    with _connections_lock:
+        if path not in _connections:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            _connections[path] = (conn, threading.Lock())
+        return _connections[path]
+
+def close(path : str = default_path):
+    '''Close the shared connection to path, if one is open; the next IdMap on path opens a new one.'''
+    with _connections_lock:
+        entry = _connections.pop(path, None)
+    if entry != None:
+        conn, lock = entry
+        with lock:
+            conn.close()
+
+class IdMap():
+    '''Page id <-> note id pairs for one (note type, Notion database) pair.'''
+    def __init__(self, note_type_id : int, database_id : str, path : str = default_path):
+        self.note_type_id = int(note_type_id)
+        self.database_id = str(database_id)
+        self.conn, self.lock = _connect(path)
+
+    def record(self, pairs : list):
+        '''Store (page id, note id) pairs in one transaction, replacing older pairs for either id.'''
+        now = time()
+        rows = [ (self.note_type_id, self.database_id, str(page_id), int(note_id), now) for page_id, note_id in pairs ]
+        with self.lock, self.conn:
+            # a note now paired with a different page drops its old pair first
+            self.conn.executemany("delete from id_map where note_type_id = ? and database_id = ? and note_id = ?", [ (r[0], r[1], r[3]) for r in rows ])
+            self.conn.executemany("insert or replace into id_map values (?, ?, ?, ?, ?)", rows)
+
+    def _lookup(self, select : str, where : str, keys : list) -> dict:
+        out = {}
+        keys = list(keys)
+        with self.lock:
+            for start in range(0, len(keys), _BATCH):
+                batch = keys[start:start + _BATCH]
+                marks = ",".join("?" * len(batch))
+                query = f"select {where}, {select} from id_map where note_type_id = ? and database_id = ? and {where} in ({marks})"
+                for key, value in self.conn.execute(query, [self.note_type_id, self.database_id] + batch):
+                    out[key] = value
+        return out
+
+    def notes_for_pages(self, page_ids : list) -> dict:
+        return self._lookup("note_id", "page_id", [ str(p) for p in page_ids ])
+
+    def pages_for_notes(self, note_ids : list) -> dict:
+        return self._lookup("page_id", "note_id", [ int(n) for n in note_ids ])
+
+    def note_for_page(self, page_id : str):
+        return self.notes_for_pages([page_id]).get(str(page_id))
+
+    def page_for_note(self, note_id : int):
+        return self.pages_for_notes([note_id]).get(int(note_id))
+
+    def remove_notes(self, note_ids : list):
+        with self.lock, self.conn:
+            self.conn.executemany("delete from id_map where note_type_id = ? and database_id = ? and note_id = ?", [ (self.note_type_id, self.database_id, int(n)) for n in note_ids ])
+
+    def remove_pages(self, page_ids : list):
+        with self.lock, self.conn:
+            self.conn.executemany("delete from id_map where note_type_id = ? and database_id = ? and page_id = ?", [ (self.note_type_id, self.database_id, str(p)) for p in page_ids ])
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("select count(*) from id_map where note_type_id = ? and database_id = ?", (self.note_type_id, self.database_id)).fetchone()[0]
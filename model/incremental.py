@@ -0,0 +1,70 @@
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+
+# Incremental syncs: after the first run only pages changed since the stored watermark are read.
+
+@dataclass
+class Watermark():
+    # wall clock time of the last successful sync, ISO 8601 UTC
+    synced_at : str = None
+    # largest Anki note mod (seconds) seen in the last sync
+    anki_mod : int = 0
+    # largest Notion last_edited_time seen in the last sync, as returned by the API
+    notion_last_edited : str = None
+
+    @staticmethod
+    def from_dict(d : dict):
+        if d == None:
+            return Watermark()
+        return Watermark(d.get("synced_at"), d.get("anki_mod", 0), d.get("notion_last_edited"))
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+def load_watermark(config, note_type_id, database_id) -> Watermark:
+    return Watermark.from_dict(config.get_watermark(note_type_id, database_id))
+
+def notion_last_edited_filter(watermark : Watermark):
+    '''Notion database query filter for pages edited since the watermark, or None for a full read.'''
+    if watermark.notion_last_edited == None:
+        return None
+    return {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": watermark.notion_last_edited}}
+
+def advance_watermark(watermark : Watermark, anki_mod : int = 0, notion_last_edited : str = None) -> Watermark:
+    '''Watermark to store after a successful sync that saw anki_mod / notion_last_edited.'''
+    if notion_last_edited == None or (watermark.notion_last_edited != None and notion_last_edited < watermark.notion_last_edited):
+        notion_last_edited = watermark.notion_last_edited
+    return Watermark(
+        datetime.now(timezone.utc).isoformat(),
+        max(watermark.anki_mod, anki_mod),
+        notion_last_edited
+    )
+
+def save_watermark(config, note_type_id, database_id, watermark : Watermark):
+    config.save_watermark(note_type_id, database_id, watermark.to_dict())
+
+def _notion_time(moment : datetime) -> str:
+    # Notion rounds last_edited_time down to the minute, so marks are too
+    return moment.replace(second=0, microsecond=0).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+class IncrementalSync():
+    '''The Notion side watermark of one (note type, Notion database) pair, as used by one download.
+
+    The download reads through a NotionPageReader given notion_filter(), so only pages edited since the mark
+    are read at all, and the job calls save once it succeeds. Uploads don't take a watermark: they can only
+    append, so they are keyed on the upload snapshot instead (an edited note read again would be a duplicate page).'''
+    def __init__(self, config, note_type_id, database_id):
+        self.config = config
+        self.note_type_id = note_type_id
+        self.database_id = database_id
+        self.watermark = load_watermark(config, note_type_id, database_id)
+        # taken before anything is read, so pages edited during the run are read again next time
+        self.started = _notion_time(datetime.now(timezone.utc))
+
+    def notion_filter(self):
+        '''Query filter for pages edited since the mark, or None on the first download.'''
+        return notion_last_edited_filter(self.watermark)
+
+    def save(self):
+        watermark = advance_watermark(self.watermark, notion_last_edited = self.started)
+        save_watermark(self.config, self.note_type_id, self.database_id, watermark)
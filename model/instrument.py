@@ -0,0 +1,158 @@
+import json
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter, time
+
+# Per-stage timing and counters for syncs. Readers, writers and jobs take a trace through their
+# parameters; NULL_TRACE is the default and does nothing, so instrumentation costs next to nothing
+# unless it has been asked for.
+
+class SyncTrace():
+    '''Wall time, rows and bytes per stage, plus per-call latencies (e.g. Notion requests).'''
+    enabled = True
+
+    def __init__(self):
+        self.started = time()
+        # stage name -> [seconds, rows, bytes, count]
+        self.stages = {}
+        # call name -> list of seconds
+        self.calls = {}
+        # pipelined syncs record from several threads
+        self.lock = Lock()
+
+    @contextmanager
+    def stage(self, name : str):
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, perf_counter() - start)
+
+    def add(self, name : str, seconds : float = 0.0, rows : int = 0, nbytes : int = 0):
+        with self.lock:
+            entry = self.stages.get(name)
+            if entry == None:
+                entry = self.stages[name] = [0.0, 0, 0, 0]
+            entry[0] += seconds
+            entry[1] += rows
+            entry[2] += nbytes
+            if seconds > 0:
+                entry[3] += 1
+
+    def count(self, name : str, rows : int = 0, nbytes : int = 0):
+        '''Add rows / bytes to a stage without timing anything.'''
+        self.add(name, 0.0, rows, nbytes)
+
+    def call(self, name : str, seconds : float):
+        with self.lock:
+            self.calls.setdefault(name, []).append(seconds)
+
+    def summary(self) -> dict:
+        with self.lock:
+            stage_items = [ (name, list(entry)) for name, entry in self.stages.items() ]
+            call_items = [ (name, list(latencies)) for name, latencies in self.calls.items() ]
+        stages = {}
+        for name, (seconds, rows, nbytes, count) in stage_items:
+            stages[name] = {
+                "seconds": round(seconds, 4),
+                "calls": count,
+                "rows": rows,
+                "rows_per_sec": round(rows / seconds, 1) if seconds > 0 and rows > 0 else None,
+                "bytes": nbytes
+            }
+        calls = {}
+        for name, latencies in call_items:
+            ordered = sorted(latencies)
+            calls[name] = {
+                "count": len(ordered),
+                "mean": round(sum(ordered) / len(ordered), 4),
+                "p50": round(ordered[len(ordered) // 2], 4),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+                "max": round(ordered[-1], 4)
+            }
+        return {"started": self.started, "stages": stages, "calls": calls}
+
+    def dump(self, path : str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=4)
+
+class _NullStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+class NullTrace():
+    '''Stand-in used when tracing is off; every method is a no-op.'''
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name : str):
+        return self._stage
+
+    def add(self, name : str, seconds : float = 0.0, rows : int = 0, nbytes : int = 0):
+        pass
+
+    def count(self, name : str, rows : int = 0, nbytes : int = 0):
+        pass
+
+    def call(self, name : str, seconds : float):
+        pass
+
+    def summary(self) -> dict:
+        return {}
+
+    def dump(self, path : str):
+        pass
+
+NULL_TRACE = NullTrace()
+
+class TracedSource():
+    '''Wraps a reader or writer that takes no trace (core's Notion classes) so each read / write call is
+    recorded as a call latency named prefix.method; everything else is passed through.'''
+    def __init__(self, source, trace, prefix : str):
+        self.source = source
+        self.trace = trace
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def _timed(self, name : str, fn, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.trace.call(f"{self.prefix}.{name}", perf_counter() - start)
+
+    async def _timed_async(self, name : str, fn, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            self.trace.call(f"{self.prefix}.{name}", perf_counter() - start)
+
+    def read_records_sync(self, *args, **kwargs):
+        return self._timed("read_records", self.source.read_records_sync, *args, **kwargs)
+
+    async def read_records(self, *args, **kwargs):
+        return await self._timed_async("read_records", self.source.read_records, *args, **kwargs)
+
+    def write_records_sync(self, *args, **kwargs):
+        return self._timed("write_records", self.source.write_records_sync, *args, **kwargs)
+
+    async def write_records(self, *args, **kwargs):
+        return await self._timed_async("write_records", self.source.write_records, *args, **kwargs)
+
+def with_summary(status, trace):
+    '''status (a core SyncStatus) with trace.summary() attached as status.trace when tracing is on.'''
+    if trace.enabled:
+        status.trace = trace.summary()
+    return status
+
+def traced(source, trace, prefix : str):
+    '''source wrapped in a TracedSource, or source itself when tracing is off.'''
+    if not trace.enabled:
+        return source
+    return TracedSource(source, trace, prefix)
@@ -0,0 +1,59 @@
+import json
+import os
+import re
+from os.path import dirname, exists, join, realpath
+
+# Write-ahead journal for long syncs. After each committed chunk the job appends (and fsyncs)
+# one line with the row cursor, the source cursor and the ids of the rows it wrote, so that a
+# restarted job can skip everything already written instead of duplicating it.
+
+default_directory = join(dirname(realpath(__file__)), 'journals')
+
+class SyncJournal():
+    '''Append-only journal of the chunks committed by one job.'''
+    def __init__(self, job_id : str, directory : str = default_directory):
+        self.job_id = job_id
+        self.path = join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", job_id) + ".journal")
+        # rows committed so far, counted in source order
+        self.cursor = 0
+        self.source_cursor = None
+        self.committed_ids = set()
+        self._load()
+
+    def _load(self):
+        if not exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break # torn write from a crash; everything before it is good
+                self.cursor = entry["cursor"]
+                self.source_cursor = entry.get("source_cursor")
+                self.committed_ids.update(entry.get("ids", []))
+
+    @property
+    def resuming(self) -> bool:
+        return self.cursor > 0
+
+    def commit(self, cursor : int, ids : list = None, source_cursor = None):
+        '''Record that every row before cursor has been written.'''
+        ids = list(ids) if ids != None else []
+        entry = {"cursor": cursor, "ids": ids, "source_cursor": source_cursor}
+        os.makedirs(dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.cursor = cursor
+        self.source_cursor = source_cursor
+        self.committed_ids.update(ids)
+
+    def finish(self):
+        '''The job completed; nothing left to resume.'''
+        if exists(self.path):
+            os.remove(self.path)
+        self.cursor = 0
+        self.source_cursor = None
+        self.committed_ids = set()
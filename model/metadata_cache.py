@@ -0,0 +1,51 @@
+from threading import Lock
+from time import monotonic
+
+# Schema metadata (tables, columns, decks) for every source, cached with a TTL so that opening
+# dialogs and starting syncs doesn't repeat the same collection queries / Notion requests.
+# Entries are dropped early through invalidate() when a schema is known to have changed.
+
+DEFAULT_TTL = 300
+
+class MetadataCache():
+    '''TTL cache keyed by (source, table id, kind).'''
+    def __init__(self, ttl : float = DEFAULT_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        # syncs read metadata from background threads
+        self.lock = Lock()
+
+    def get(self, source, table_id, kind : str, loader):
+        '''Cached value for the key, calling loader() to fill it if missing or expired.'''
+        key = (source, table_id, kind)
+        now = monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None and entry[0] > now:
+                return entry[1]
+        value = loader()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, source = None, table_id = None):
+        '''Drop entries for a table, a whole source, or everything.'''
+        with self.lock:
+            if source == None:
+                self.entries.clear()
+                return
+            for key in list(self.entries):
+                if key[0] == source and (table_id == None or key[1] == table_id or key[1] == None):
+                    del self.entries[key]
+
+schema_cache = MetadataCache()
+
+def _table_id(table):
+    # TableSpec parameters hold the source's id for the table
+    return table.parameters.get("id") if table != None else None
+
+def cached_tables(reader, source):
+    return schema_cache.get(source, None, "tables", reader.get_tables)
+
+def cached_columns(reader, source):
+    return schema_cache.get(source, _table_id(reader.table), "columns", reader.get_columns)
@@ -1,10 +1,19 @@
 from .config import ConfigManager
-from core.sync import *
+from .startup import startup_timer
 
 class ModelManager():
     def __init__(self):
         self.load_config()
-        self.sync = sync
+        self._sync = None
+
+    @property
+    def sync(self):
+        # core.sync pulls in the Notion client and requests, so it's only imported when first needed
+        if self._sync is None:
+            with startup_timer.phase("import core.sync"):
+                from core.sync import sync
+            self._sync = sync
+        return self._sync
 
     def load_config(self):
         self.config = ConfigManager()
@@ -0,0 +1,182 @@
+from datetime import date, datetime
+from core.sync.sync_notion import NotionSyncHandle
+from core.sync.sync_types import *
+from .instrument import NULL_TRACE
+from .notion_transport import NotionTransport, concurrent_map
+
+# Notion reads and writes on the add-on's own transport (pooled session, the shared rate limit and retries),
+# for what core's NotionReader / NotionWriter can't do: creating a large upload's pages concurrently without
+# dying on 429s, and reading only the pages edited since a download's watermark.
+
+# Notion caps each rich text object at this many characters
+TEXT_LIMIT = 2000
+# key NotionPageReader adds to each record when include_ids is set; core's NotionReader doesn't expose page ids
+PAGE_ID = "notion_page_id"
+
+_COLUMN_TYPES = {"select": COLUMN_TYPE.SELECT, "multi_select": COLUMN_TYPE.MULTI_SELECT, "date": COLUMN_TYPE.DATE}
+
+def _rich_text(text : str) -> list:
+    return [ {"type": "text", "text": {"content": text[i:i + TEXT_LIMIT]}} for i in range(0, len(text), TEXT_LIMIT) ]
+
+def _plain_text(parts : list) -> str:
+    return "".join( part.get("plain_text", part.get("text", {}).get("content", "")) for part in parts or [] )
+
+def property_value(prop : dict):
+    '''A page property as a record value: text, a select name, a list of names, a datetime or a plain value.'''
+    kind = prop.get("type")
+    value = prop.get(kind)
+    if kind in ("title", "rich_text"):
+        return _plain_text(value)
+    if kind == "select":
+        return value.get("name") if value else None
+    if kind == "multi_select":
+        return [ option["name"] for option in value or [] ]
+    if kind == "date":
+        if not value or not value.get("start"):
+            return None
+        return datetime.fromisoformat(value["start"].replace("Z", "+00:00"))
+    if kind in ("number", "checkbox", "url", "email", "phone_number"):
+        return value
+    return None
+
+def property_json(kind : str, value):
+    '''A record value as the body of a page property of Notion type kind, or None if kind isn't supported.'''
+    if kind in ("title", "rich_text"):
+        return {kind: _rich_text("" if value == None else str(value))}
+    if kind == "select":
+        return {"select": {"name": str(value)} if value not in (None, "") else None}
+    if kind == "multi_select":
+        if isinstance(value, str):
+            value = [ v.strip() for v in value.split(",") if v.strip() != "" ]
+        return {"multi_select": [ {"name": str(v)} for v in value or [] ]}
+    if kind == "date":
+        if value in (None, ""):
+            return {"date": None}
+        return {"date": {"start": value.isoformat() if isinstance(value, (date, datetime)) else str(value)}}
+    if kind == "number":
+        try:
+            return {"number": float(value) if value not in (None, "") else None}
+        except (TypeError, ValueError):
+            return {"number": None}
+    return None
+
+class NotionPageReader(SourceReader):
+    '''Read the pages of a Notion database through a NotionTransport, a page of up to 100 records per query.
+
+    filter is a Notion database query filter (see incremental.notion_last_edited_filter); handles carry Notion's
+    start_cursor, so a read can be resumed from a saved cursor. With include_ids, each record has its page id
+    under PAGE_ID, for the id map.'''
+    def __init__(self, parameters : dict):
+        self.trace = parameters.get("trace", NULL_TRACE)
+        self.transport = parameters.get("transport")
+        if self.transport == None:
+            self.transport = NotionTransport(parameters["notion_key"], trace = self.trace)
+        self.filter = parameters.get("filter")
+        self.include_ids = parameters.get("include_ids", False)
+        self.table = None
+        self._columns = None
+
+    def set_table(self, table : TableSpec):
+        if table.source != DATA_SOURCE.NOTION:
+            raise SyncError(SYNC_ERROR_CODE.INCORRECT_SOURCE)
+        self.table = table
+        self._columns = None
+
+    def get_columns(self) -> list:
+        if self._columns == None:
+            database = self.transport.get(f"databases/{self.table.parameters['id']}")
+            self._columns = [ DataColumn(_COLUMN_TYPES.get(prop["type"], COLUMN_TYPE.TEXT), name) for name, prop in database.get("properties", {}).items() ]
+        return list(self._columns)
+
+    def _page_to_record(self, page : dict) -> dict:
+        record = { name: property_value(prop) for name, prop in page.get("properties", {}).items() }
+        if self.include_ids:
+            record[PAGE_ID] = page["id"]
+        return record
+
+    def read_records_sync(self, limit : int = -1, next_iterator : NotionSyncHandle = None) -> NotionSyncHandle:
+        if self.table == None:
+            raise SyncError(SYNC_ERROR_CODE.PARAMETER_NOT_FOUND, "No table set in NotionPageReader; can't read records.")
+        cursor = next_iterator.handle if next_iterator != None else None
+        database_id = self.table.parameters["id"]
+        records = []
+        done = False
+        while not done and (limit < 0 or len(records) < limit):
+            page_size = 100 if limit < 0 else min(100, limit - len(records))
+            with self.trace.stage("notion.query"):
+                result = self.transport.query_database(database_id, cursor, page_size, self.filter)
+            records.extend( self._page_to_record(page) for page in result.get("results", []) )
+            cursor = result.get("next_cursor")
+            done = not result.get("has_more")
+        self.trace.count("notion.query", len(records))
+        columns = self.get_columns()
+        if self.include_ids:
+            columns.append(DataColumn(COLUMN_TYPE.TEXT, PAGE_ID))
+        return NotionSyncHandle(DataSet(columns, records), DATA_SOURCE.NOTION, cursor, done)
+
+    async def read_records(self, limit : int = -1, next_iterator : NotionSyncHandle = None) -> NotionSyncHandle:
+        return self.read_records_sync(limit, next_iterator)
+
+class NotionPageWriter(SourceWriter):
+    '''Create a page in a Notion database for each record, several at once, through a NotionTransport.
+
+    Record keys with no database property of the same name (or of a type it can't write) are left out. With an
+    id_map, the page created for each record's id_column (its note id) is recorded, and records whose note is
+    already paired with a page, uploaded before or downloaded from Notion, aren't created again.'''
+    def __init__(self, parameters : dict):
+        self.trace = parameters.get("trace", NULL_TRACE)
+        self.transport = parameters.get("transport")
+        if self.transport == None:
+            self.transport = NotionTransport(parameters["notion_key"], trace = self.trace)
+        # pages created at once; the transport's token bucket keeps them under the rate limit whatever this is
+        self.workers = parameters.get("workers", 4)
+        self.id_map = parameters.get("id_map")
+        self.id_column = parameters.get("id_column")
+        self.table = None
+        self._property_types = None
+
+    def set_table(self, table : TableSpec):
+        if table.source != DATA_SOURCE.NOTION:
+            raise SyncError(SYNC_ERROR_CODE.INCORRECT_SOURCE)
+        self.table = table
+        self._property_types = None
+
+    def _types(self) -> dict:
+        # property name -> Notion type, read once per table
+        if self._property_types == None:
+            database = self.transport.get(f"databases/{self.table.parameters['id']}")
+            self._property_types = { name: prop["type"] for name, prop in database.get("properties", {}).items() }
+        return self._property_types
+
+    def _properties(self, record : dict) -> dict:
+        types = self._types()
+        properties = {}
+        for name, value in record.items():
+            if name in types:
+                body = property_json(types[name], value)
+                if body != None:
+                    properties[name] = body
+        return properties
+
+    def write_records_sync(self, dataset : DataSet, limit : int = -1, next_iterator : NotionSyncHandle = None) -> NotionSyncHandle:
+        # the handle carries the row index to carry on from, as AnkiWriter's does
+        if self.table == None:
+            raise SyncError(SYNC_ERROR_CODE.PARAMETER_NOT_FOUND, "No table set in NotionPageWriter; can't write records.")
+        start = next_iterator.handle if next_iterator != None else 0
+        total = len(dataset.records)
+        end = total if limit < 0 else min(start + limit, total)
+        records = [ record.asdict() for record in dataset.records[start:end] ]
+        mapping = self.id_map != None and self.id_column != None
+        if mapping:
+            paired = self.id_map.pages_for_notes([ record[self.id_column] for record in records if record.get(self.id_column) != None ])
+            records = [ record for record in records if record.get(self.id_column) not in paired ]
+        database_id = self.table.parameters["id"]
+        with self.trace.stage("notion.create_pages"):
+            pages = concurrent_map(lambda record: self.transport.create_page(database_id, self._properties(record)), records, self.workers)
+        self.trace.count("notion.create_pages", len(records))
+        if mapping:
+            self.id_map.record([ (page["id"], record[self.id_column]) for page, record in zip(pages, records) if record.get(self.id_column) != None ])
+        return NotionSyncHandle(dataset, DATA_SOURCE.NOTION, end, end >= total)
+
+    async def write_records(self, dataset : DataSet, limit : int = -1, next_iterator : NotionSyncHandle = None) -> NotionSyncHandle:
+        return self.write_records_sync(dataset, limit, next_iterator)
@@ -0,0 +1,171 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep, time
+
+import requests
+from requests.adapters import HTTPAdapter
+from .instrument import NULL_TRACE
+
+# HTTP transport for the Notion API: one pooled keep-alive session, a token bucket shared by every
+# thread so concurrent writers stay under Notion's rate limit (about 3 requests a second), and
+# retries with jittered exponential backoff for 429s and 5xxs that honour Retry-After.
+
+NOTION_API = "https://api.notion.com/v1"
+NOTION_VERSION = "2022-02-22"
+RATE_LIMIT = 3.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class BearerAuth(requests.auth.AuthBase):
+    def __init__(self, token):
+        self.token = token
+    def __call__(self, r):
+        r.headers["authorization"] = "Bearer " + self.token
+        return r
+
+class TokenBucket():
+    '''Thread-safe token bucket: rate tokens a second, holding at most burst.'''
+    def __init__(self, rate : float = RATE_LIMIT, burst : int = 3):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def pause(self, seconds : float):
+        '''Stop handing out tokens for seconds (after a 429).'''
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class NotionTransportError(Exception):
+    def __init__(self, response):
+        self.response = response
+        super().__init__(f"Notion API returned {response.status_code}: {response.text[:200]}")
+
+def _retry_after(response) -> float:
+    value = response.headers.get("Retry-After")
+    if value == None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+class NotionTransport():
+    '''Pooled, rate-limited, retrying client for the Notion REST API.'''
+    def __init__(self, notion_key : str, base_url : str = NOTION_API, bucket : TokenBucket = None, max_retries : int = 5,
+                 backoff_base : float = 0.5, backoff_max : float = 30.0, pool_size : int = 8, timeout : float = 30.0, trace = NULL_TRACE):
+        self.base_url = base_url.rstrip("/")
+        # shared across transports by default so every writer counts against the same limit
+        self.bucket = bucket if bucket != None else shared_bucket
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.trace = trace
+        self.session = requests.Session()
+        self.session.auth = BearerAuth(notion_key)
+        self.session.headers.update({"Notion-Version": NOTION_VERSION, "Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def _backoff(self, attempt : int) -> float:
+        # full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method : str, path : str, json : dict = None, params : dict = None) -> dict:
+        url = path if path.startswith("http") else f"{self.base_url}/{path.lstrip('/')}"
+        call_name = f"notion.{method.lower()}.{path.split('/')[0]}"
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            start = monotonic()
+            try:
+                response = self.session.request(method, url, json=json, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self.trace.call(call_name, monotonic() - start)
+                if attempt >= self.max_retries:
+                    raise
+                sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            self.trace.call(call_name, monotonic() - start)
+            if response.status_code < 400:
+                return response.json()
+            if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                raise NotionTransportError(response)
+            wait = _retry_after(response)
+            if wait == None:
+                wait = self._backoff(attempt)
+            if response.status_code == 429:
+                self.bucket.pause(wait)
+            self.trace.count("notion.retries", 1)
+            sleep(wait)
+            attempt += 1
+
+    def get(self, path : str, params : dict = None) -> dict:
+        return self.request("GET", path, params=params)
+
+    def post(self, path : str, json : dict = None) -> dict:
+        return self.request("POST", path, json=json)
+
+    def patch(self, path : str, json : dict = None) -> dict:
+        return self.request("PATCH", path, json=json)
+
+    def query_database(self, database_id : str, start_cursor : str = None, page_size : int = 100, filter : dict = None) -> dict:
+        body = {"page_size": page_size}
+        if start_cursor != None:
+            body["start_cursor"] = start_cursor
+        if filter != None:
+            body["filter"] = filter
+        return self.post(f"databases/{database_id}/query", body)
+
+    def iter_database(self, database_id : str, page_size : int = 100, filter : dict = None):
+        '''Yield every page object of a database, following start_cursor / has_more.'''
+        cursor = None
+        while True:
+            result = self.query_database(database_id, cursor, page_size, filter)
+            for page in result.get("results", []):
+                yield page
+            if not result.get("has_more"):
+                return
+            cursor = result.get("next_cursor")
+
+    def create_page(self, database_id : str, properties : dict) -> dict:
+        return self.post("pages", {"parent": {"database_id": database_id}, "properties": properties})
+
+    def update_page(self, page_id : str, properties : dict = None, archived : bool = None) -> dict:
+        body = {}
+        if properties != None:
+            body["properties"] = properties
+        if archived != None:
+            body["archived"] = archived
+        return self.patch(f"pages/{page_id}", body)
+
+def concurrent_map(fn, items, workers : int = 4) -> list:
+    '''fn over items on a few threads; the transports' shared token bucket keeps them under the rate limit.'''
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, items))
+
+shared_bucket = TokenBucket()
@@ -0,0 +1,66 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from .html_text import html_to_text
+
+# Optional process-pool transform for large reads. Turning raw field strings into clean text is
+# pure CPU work, so big batches are split into chunks, cleaned in worker processes and
+# reassembled in order. Small batches, and any pool failure, fall back to running in-process.
+# Inside Anki a pool can fail to start at all (forking the Qt process, or spawned workers that
+# can't import the add-on), so after the first failure it isn't tried again this session.
+
+PARALLEL_THRESHOLD = 5000
+# pages are split evenly across the workers, in chunks of at least this many rows
+MIN_CHUNK = 250
+
+_pool = None
+# set once the pool has failed; everything runs in-process from then on
+_disabled = False
+
+def clean_field_rows(rows : list) -> list:
+    '''Clean every value of every row (a list of raw field strings).'''
+    return [ [ html_to_text(value) for value in row ] for row in rows ]
+
+def _can_fork_workers() -> bool:
+    # frozen builds (the packaged Anki app) would start another copy of the app for each worker
+    return not _disabled and not getattr(sys, "frozen", False)
+
+def _default_workers() -> int:
+    return max(1, (cpu_count() or 2) - 1)
+
+def _get_pool(workers : int = None):
+    global _pool
+    if _pool == None:
+        _pool = ProcessPoolExecutor(max_workers = workers or _default_workers())
+    return _pool
+
+def shutdown():
+    global _pool
+    if _pool != None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+def parallel_map_chunks(fn, items : list, threshold : int = PARALLEL_THRESHOLD, chunk_size : int = None, workers : int = None, size : int = None) -> list:
+    '''fn(list) -> list over items, split into chunks across a process pool; results keep input order.
+
+    size is how big the whole job is when items is one page of it (a paged read), and is what's compared
+    against threshold; by default it's len(items).'''
+    global _disabled
+    if size == None:
+        size = len(items)
+    if size < threshold or len(items) < 2 * MIN_CHUNK or not _can_fork_workers():
+        return fn(items)
+    if chunk_size == None:
+        chunk_size = max(MIN_CHUNK, -(-len(items) // (workers or _default_workers())))
+    chunks = [ items[i:i + chunk_size] for i in range(0, len(items), chunk_size) ]
+    try:
+        results = list(_get_pool(workers).map(fn, chunks))
+    except Exception:
+        # broken pool, pickling problems etc.; the serial result is the same, just slower
+        _disabled = True
+        shutdown()
+        return fn(items)
+    out = []
+    for result in results:
+        out.extend(result)
+    return out
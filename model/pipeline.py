@@ -0,0 +1,116 @@
+import asyncio
+from queue import Queue
+from threading import Thread
+from time import monotonic
+from .sync_job import SyncJob
+from .instrument import NULL_TRACE
+
+# Streaming sync: a reader thread prefetches pages, a transform thread cleans them and the
+# calling thread writes them. Stages are joined by bounded queues, so a slow writer holds
+# the reader back instead of letting pages pile up in memory.
+
+# marks the end of the stream on a queue
+_END = object()
+
+class _StageError():
+    def __init__(self, error : BaseException):
+        self.error = error
+
+class StreamingSync(SyncJob):
+    '''SyncJob whose read, transform and write stages overlap.'''
+    def __init__(self, reader, writer, page_size : int = 100, progress_interval : float = 0.1, transform = None, queue_size : int = 4, trace = NULL_TRACE, trace_path : str = None, journal = None, key_column : str = None, snapshot = None, watermark = None, resume = None):
+        super().__init__(reader, writer, page_size, progress_interval, trace, trace_path, journal, key_column, snapshot, watermark, resume)
+        # transform(DataSet) -> DataSet, e.g. remapping and type cleaning; runs on its own thread
+        self.transform = transform
+        self.queue_size = queue_size
+
+    async def _produce(self, out_queue : Queue, read_it = None):
+        done = False
+        while not done and not self.cancelled:
+            with self.trace.stage("job.read"):
+                read_it = await self.reader.read_records(self.page_size, read_it)
+            self.trace.count("job.read", len(read_it.records.records))
+            done = read_it.done
+            # blocks while the queue is full (backpressure)
+            out_queue.put((read_it.records, self._total(read_it), read_it))
+
+    def _read_stage(self, out_queue : Queue, read_it = None):
+        try:
+            asyncio.run(self._produce(out_queue, read_it))
+            out_queue.put(_END)
+        except BaseException as e:
+            out_queue.put(_StageError(e))
+
+    def _transform_stage(self, in_queue : Queue, out_queue : Queue):
+        while True:
+            item = in_queue.get()
+            if item is _END or isinstance(item, _StageError):
+                out_queue.put(item)
+                return
+            page, total, read_it = item
+            try:
+                if self.transform != None:
+                    with self.trace.stage("job.transform"):
+                        page = self.transform(page)
+                    self.trace.count("job.transform", len(page.records))
+            except BaseException as e:
+                self.cancelled = True
+                out_queue.put(_StageError(e))
+                self._drain(in_queue)
+                return
+            out_queue.put((page, total, read_it))
+
+    def _drain(self, in_queue : Queue):
+        # unblocks the reader after a failure downstream
+        while True:
+            item = in_queue.get()
+            if item is _END or isinstance(item, _StageError):
+                return
+
+    def _run(self, progress = None):
+        read_queue = Queue(self.queue_size)
+        write_queue = Queue(self.queue_size)
+        reader = Thread(target = self._read_stage, args = (read_queue, self._resume_handle()), daemon = True)
+        transformer = Thread(target = self._transform_stage, args = (read_queue, write_queue), daemon = True)
+        reader.start()
+        transformer.start()
+
+        last_report = 0.0
+        error = None
+        while True:
+            item = write_queue.get()
+            if item is _END:
+                break
+            if isinstance(item, _StageError):
+                error = item.error
+                break
+            page, self.rows_total, read_it = item
+            if error != None or self.cancelled:
+                continue # keep draining so the other stages can finish
+            try:
+                unwritten = self._unwritten(page, self.rows_done)
+                with self.trace.stage("job.write"):
+                    write_it = self.writer.write_records_sync(unwritten)
+                    while not write_it.done:
+                        write_it = self.writer.write_records_sync(unwritten, next_iterator = write_it)
+                self.trace.count("job.write", len(unwritten.records))
+                self.rows_done += len(page.records)
+                self._commit(unwritten, self.rows_done, read_it)
+                if self.snapshot != None:
+                    self.snapshot.add_page(page)
+            except BaseException as e:
+                error = e
+                self.cancelled = True
+                continue
+            now = monotonic()
+            if progress != None and now - last_report >= self.progress_interval:
+                last_report = now
+                progress(self.rows_done, self.rows_total)
+
+        reader.join()
+        transformer.join()
+        if error != None:
+            raise error
+        if progress != None:
+            progress(self.rows_done, self.rows_total)
+        return self.rows_done
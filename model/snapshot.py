@@ -0,0 +1,246 @@
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
+from hashlib import blake2b
+from os.path import dirname, exists, join, realpath
+
+# Columnar snapshots of synced tables. After a successful run the row key, a content hash and a
+# modified time are stored for every row as three fixed-width int64 columns, so that the next run
+# can find what changed by diffing against the memory-mapped file instead of re-reading and
+# re-merging the other side.
+#
+# File layout (little endian): magic, version, key kind, row count, then the key, hash and mod
+# columns, each row_count int64s. Rows are stored sorted by key.
+
+MAGIC = b"ANCS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHq")
+KEY_INT = 0 # keys are stored as-is (Anki note ids)
+KEY_HASHED = 1 # keys are 64 bit hashes of their string form (Notion page ids, primary keys)
+
+default_directory = join(dirname(realpath(__file__)), 'snapshots')
+
+def _hash64(data : bytes) -> int:
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "little", signed=True)
+
+def _value_bytes(value) -> bytes:
+    if value == None:
+        return b""
+    if isinstance(value, list):
+        return b"\x1e".join(_value_bytes(v) for v in value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat().encode("utf-8")
+    return str(value).encode("utf-8")
+
+def content_hash(record : dict, column_names : list) -> int:
+    '''64 bit hash of a record's values, in column order.'''
+    return _hash64(b"\x1f".join(_value_bytes(record.get(name)) for name in column_names))
+
+def _table_name(table) -> str:
+    source = getattr(table.source, "name", table.source)
+    table_id = str(table.parameters.get("id", table.name)).replace(os.sep, "_")
+    return f"{source}-{table_id}"
+
+def snapshot_path(table, directory : str = default_directory, target = None) -> str:
+    '''Where the snapshot for a TableSpec is kept; target is the table it was synced to, if it goes to several.'''
+    name = _table_name(table) if target == None else f"{_table_name(table)}-{_table_name(target)}"
+    return join(directory, f"{name}.snap")
+
+class Snapshot():
+    '''Key, content hash and mod columns of one table, memory-mapped from disk.'''
+    def __init__(self, keys, hashes, mods, key_kind : int, _mm = None):
+        self.keys = keys
+        self.hashes = hashes
+        self.mods = mods
+        self.key_kind = key_kind
+        self._mm = _mm
+
+    def __len__(self):
+        return len(self.keys)
+
+    def close(self):
+        if self._mm != None:
+            # views into the map have to be released before it can close
+            self.keys.release()
+            self.hashes.release()
+            self.mods.release()
+            self._mm.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def key_of(self, key) -> int:
+        return key if self.key_kind == KEY_INT else _hash64(str(key).encode("utf-8"))
+
+    def find(self, key) -> int:
+        '''Position of key, or -1; a binary search over the mapped key column, which is stored sorted.'''
+        k = self.key_of(key)
+        pos = bisect_left(self.keys, k)
+        if pos < len(self.keys) and self.keys[pos] == k:
+            return pos
+        return -1
+
+    @staticmethod
+    def open(path : str):
+        if not exists(path) or os.path.getsize(path) < HEADER.size:
+            return None
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, key_kind, rows = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            return None
+        view = memoryview(mm)
+        width = rows * 8
+        start = HEADER.size
+        keys = view[start:start + width].cast("q")
+        hashes = view[start + width:start + 2 * width].cast("q")
+        mods = view[start + 2 * width:start + 3 * width].cast("q")
+        view.release()
+        return Snapshot(keys, hashes, mods, key_kind, mm)
+
+    @staticmethod
+    def write(path : str, rows, key_kind : int = KEY_HASHED, keys_hashed : bool = False):
+        '''Write rows of (key, content hash, mod); keys are hashed first unless key_kind is KEY_INT or they already are.'''
+        if key_kind == KEY_HASHED and not keys_hashed:
+            rows = [ (_hash64(str(key).encode("utf-8")), h, m) for key, h, m in rows ]
+        rows = sorted(rows)
+        keys, hashes, mods = array("q"), array("q"), array("q")
+        for key, h, m in rows:
+            keys.append(key)
+            hashes.append(h)
+            mods.append(int(m))
+        os.makedirs(dirname(path), exist_ok=True)
+        # write then rename, so a crash never leaves a half written snapshot
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, key_kind, len(keys)))
+            keys.tofile(f)
+            hashes.tofile(f)
+            mods.tofile(f)
+        os.replace(tmp_path, path)
+
+class SnapshotDiff():
+    def __init__(self):
+        # keys as given to diff()
+        self.added = []
+        self.changed = []
+        self.unchanged = []
+        # snapshot keys (ints, hashed for KEY_HASHED snapshots) with no row in the fresh data
+        self.removed = []
+
+def diff(snapshot : Snapshot, fresh, find_removed : bool = True) -> SnapshotDiff:
+    '''Compare fresh rows of (key, content hash) against a snapshot.
+
+    Only the fresh rows are sorted; they're then merge joined against the snapshot's sorted key column,
+    which is read in place from the map, bisecting past the keys in between. Result lists keep the order
+    of fresh. Finding removed keys walks the whole snapshot, so a caller diffing one page at a time skips it.'''
+    result = SnapshotDiff()
+    # (snapshot key, position in fresh) is unique, so the original keys are never compared
+    rows = sorted( (snapshot.key_of(key), index, key, h) for index, (key, h) in enumerate(fresh) )
+    keys = snapshot.keys
+    hashes = snapshot.hashes
+    count = len(keys)
+    seen = bytearray(count)
+    status = [None] * len(rows)
+    pos = 0
+    for k, index, key, h in rows:
+        pos = bisect_left(keys, k, pos)
+        if pos < count and keys[pos] == k:
+            seen[pos] = 1
+            status[index] = (result.unchanged if hashes[pos] == h else result.changed, key)
+        else:
+            status[index] = (result.added, key)
+    for target, key in status:
+        target.append(key)
+    if find_removed:
+        result.removed = [ keys[pos] for pos in range(count) if not seen[pos] ]
+    return result
+
+def _merge_rows(previous : Snapshot, rows : list) -> list:
+    # rows of (snapshot key, hash, mod) from a partial read, merged into the previous snapshot; fresh rows win
+    fresh = sorted( (previous.key_of(key), h, m) for key, h, m in rows )
+    keys, hashes, mods = previous.keys, previous.hashes, previous.mods
+    merged = []
+    pos = 0
+    for row in fresh:
+        while pos < len(keys) and keys[pos] < row[0]:
+            merged.append((keys[pos], hashes[pos], mods[pos]))
+            pos += 1
+        if pos < len(keys) and keys[pos] == row[0]:
+            pos += 1
+        merged.append(row)
+    merged.extend( (keys[p], hashes[p], mods[p]) for p in range(pos, len(keys)) )
+    return merged
+
+class SnapshotBuilder():
+    '''Collects (key, hash, mod) for each page a job writes, and saves them once the job succeeds.
+
+    With merge set the job only read part of the table (a filtered read), so rows of the previous
+    snapshot that weren't read again are kept. added() diffs a page against the previous snapshot, for
+    jobs whose writer can only append.'''
+    def __init__(self, path : str, key_column : str, mod_column : str = None, key_kind : int = KEY_HASHED, merge : bool = False):
+        self.path = path
+        self.key_column = key_column
+        self.mod_column = mod_column
+        self.key_kind = key_kind
+        self.merge = merge
+        self.rows = []
+        self._opened = False
+        self._previous_snapshot = None
+
+    def _previous(self) -> Snapshot:
+        # the last saved snapshot, opened on first use and kept open until save or close
+        if not self._opened:
+            self._opened = True
+            previous = Snapshot.open(self.path)
+            if previous != None and previous.key_kind != self.key_kind:
+                previous.close()
+                previous = None
+            self._previous_snapshot = previous
+        return self._previous_snapshot
+
+    def close(self):
+        if self._previous_snapshot != None:
+            self._previous_snapshot.close()
+            self._previous_snapshot = None
+
+    def added(self, page):
+        '''The rows of page whose key the previous snapshot doesn't have; all of them if there's no snapshot yet.'''
+        previous = self._previous()
+        if previous == None:
+            return page
+        column_names = page.column_names
+        records = [ record.asdict() for record in page.records ]
+        result = diff(previous, [ (values[self.key_column], content_hash(values, column_names)) for values in records ], find_removed = False)
+        if len(result.added) == len(records):
+            return page
+        added = set(result.added)
+        return type(page)(page.columns, [ values for values in records if values[self.key_column] in added ])
+
+    def add_page(self, page):
+        column_names = page.column_names
+        for record in page.records:
+            values = record.asdict()
+            mod = values.get(self.mod_column) if self.mod_column != None else 0
+            if isinstance(mod, datetime):
+                mod = int(mod.timestamp())
+            self.rows.append((values[self.key_column], content_hash(values, column_names), mod or 0))
+
+    def save(self):
+        previous = self._previous() if self.merge else None
+        if previous == None:
+            self.close()
+            Snapshot.write(self.path, self.rows, self.key_kind)
+            return
+        rows = _merge_rows(previous, self.rows)
+        # the map has to be gone before the file is replaced
+        self.close()
+        Snapshot.write(self.path, rows, self.key_kind, keys_hashed = True)
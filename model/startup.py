@@ -0,0 +1,26 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+# Timings for the add-on's startup phases (imports, config load, dialog construction), so that
+# work done at profile load can be seen and kept small.
+
+class StartupTimer():
+    def __init__(self):
+        # (phase name, seconds) in the order the phases finished
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name : str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, perf_counter() - start))
+
+    def report(self) -> str:
+        lines = [ f"{name}: {seconds * 1000:.1f} ms" for name, seconds in self.phases ]
+        total = sum(seconds for _, seconds in self.phases)
+        lines.append(f"Total: {total * 1000:.1f} ms")
+        return "\n".join(lines)
+
+startup_timer = StartupTimer()
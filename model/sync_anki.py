@@ -1,18 +1,60 @@
-from collections import deque
-from typing import Deque
+from time import perf_counter
+from dataclasses import dataclass, field
+from typing import Callable
 from anki import collection
 from anki.decks import DeckManager
 from core.sync.sync_notion import NotionSyncHandle
 from core.sync.sync_types import *
 from anki.models import *
 from anki.notes import *
-from aqt import mw
+from anki.utils import ids2str
+from aqt import gui_hooks, mw
 from aqt.utils import showInfo, qconnect
 from aqt.qt import *
-from re import sub
+from .html_text import html_to_text
+from .columnar import ColumnarDataSet
+from .dataset_index import DataSetIndex
+from .metadata_cache import schema_cache
+from .instrument import NULL_TRACE, with_summary
+from .parallel import PARALLEL_THRESHOLD, clean_field_rows, parallel_map_chunks
+
+# separator between fields in the flds column of the notes table
+FIELD_SEPARATOR = "\x1f"
+# key AnkiReader adds to each record when include_ids is set
+NOTE_ID = "note_id"
+
+@dataclass
+class UpdateResult():
+    updated : int = 0
+    unchanged : int = 0
+    # positions of incoming rows with no existing note for their key, for the caller to append (soft / hard merge)
+    unmatched : list = field(default_factory=list)
+
+@dataclass
+class MergePlan():
+    # everything a merge will change, worked out from one read and one join before anything is written
+    changes : list = field(default_factory=list) # (note id, {field: new value})
+    pairs : list = field(default_factory=list) # (page id, note id) for the id map
+    unmatched : list = field(default_factory=list)
+    unchanged : int = 0
+    # ids of notes no incoming row matched, which a hard merge deletes; only worked out when asked for
+    orphans : list = field(default_factory=list)
 
 @dataclass
 class AnkiSyncHandle(SyncHandle):
+    # cursor state for paged reads: the sorted note ids and the offset of the next page
+    id_list : list = field(default_factory=list)
+    it : int = 0
+    # newest note modification time seen so far
+    max_mod : int = 0
+    # writes: the undo entry every chunk is merged into, and (rows, seconds) for each committed chunk
+    undo_id : int = None
+    chunk_timings : list = field(default_factory=list)
+    # the reader / writer's SyncTrace (NULL_TRACE when tracing is off)
+    trace : object = NULL_TRACE
+    # append-with-dedup: the _Dedup state carried between pages, and how many duplicate rows were skipped
+    dedup : object = None
+    skipped : int = 0
 
     def __init_subclass__(cls) -> None:
         return super().__init_subclass__()
@@ -26,29 +68,243 @@ class AnkiSyncHandle(SyncHandle):
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
+def _checksum(text : str) -> int:
+    # the same checksum Anki stores in notes.csum for a note's first field
+    from anki import utils
+    if hasattr(utils, "field_checksum"):
+        return utils.field_checksum(text)
+    return utils.fieldChecksum(text)
+
+def _strip_for_checksum(text : str) -> str:
+    from anki import utils
+    if hasattr(utils, "strip_html_media"):
+        return utils.strip_html_media(text)
+    return utils.stripHTMLMedia(text)
+
+class _Dedup():
+    '''Keys of the notes already in a note type, for constant time duplicate checks while appending.
+
+    Without a key column, keys are the first-field checksums Anki already stores (notes.csum), each mapped to
+    the stripped first fields behind it, all loaded in one query; a checksum hit is confirmed against those,
+    since checksums can collide. With a key column, that field's cleaned text is the key.'''
+    def __init__(self, note_type_id : int, field_names : list, key_column : str = None):
+        self.note_type_id = note_type_id
+        self.key_column = key_column
+        if key_column == None:
+            self.key_column = field_names[0]
+            self.keys = {}
+            for csum, flds in mw.col.db.all("select csum, flds from notes where mid = ?", note_type_id):
+                self.keys.setdefault(csum, set()).add(_strip_for_checksum(flds.split(FIELD_SEPARATOR)[0]))
+        else:
+            index = field_names.index(key_column)
+            self.keys = set()
+            for flds in mw.col.db.list("select flds from notes where mid = ?", note_type_id):
+                values = flds.split(FIELD_SEPARATOR)
+                self.keys.add(html_to_text(values[index]) if index < len(values) else "")
+        self.use_checksum = key_column == None
+        # exact keys written in this run, so duplicates within the incoming rows are caught too
+        self.written = set()
+
+    def _key(self, record : dict) -> str:
+        # cleaned the same way as the stored fields, so markup or entities in the incoming value still match
+        return html_to_text(str(record.get(self.key_column, "")))
+
+    def is_duplicate(self, record : dict) -> bool:
+        if not self.use_checksum:
+            value = self._key(record)
+            return value in self.keys or value in self.written
+        value = str(record.get(self.key_column, ""))
+        stripped = _strip_for_checksum(value)
+        if stripped in self.written:
+            return True
+        return stripped in self.keys.get(_checksum(value), ())
+
+    def add(self, record : dict):
+        if not self.use_checksum:
+            self.written.add(self._key(record))
+        else:
+            self.written.add(_strip_for_checksum(str(record.get(self.key_column, ""))))
+
 class AnkiWriter(SourceWriter):
     '''Write records to Anki.'''
+    # Anki fields are all text
+    type_clean = {
+        COLUMN_TYPE.SELECT: COLUMN_TYPE.TEXT,
+        COLUMN_TYPE.DATE: COLUMN_TYPE.TEXT,
+        COLUMN_TYPE.MULTI_SELECT: COLUMN_TYPE.TEXT
+    }
+
     def __init__(self, parameters : dict):
         if mw.col == None:
             mw.loadCollection()
         self.table = None
+        # notes are built and added in chunks of this size, one bulk add per chunk
+        self.chunk_size = parameters.get("chunk_size", 500)
+        # called as chunk_callback(rows, seconds) after each chunk is committed
+        self.chunk_callback = parameters.get("chunk_callback")
+        self.trace = parameters.get("trace", NULL_TRACE)
+        # append with dedup: rows whose key already exists in the note type are skipped.
+        # The key is the first field (checked through Anki's stored checksums) unless dedup_column names another field.
+        self.dedup = parameters.get("dedup", False)
+        self.dedup_column = parameters.get("dedup_column")
+        # kept between write calls, so a streamed job loads the existing keys once rather than once per page
+        self._dedup = None
+        # optional IdMap for this note type / Notion database, and the record column holding each row's page id.
+        # Pairs are recorded as notes are written, updates route mapped rows straight to their notes, and rows
+        # whose page is already paired with an existing note aren't appended again.
+        self.id_map = parameters.get("id_map")
+        self.id_column = parameters.get("id_column")
+        # records arrive already through prepare() (a pipeline's transform stage), so writes skip type cleaning
+        self.pre_cleaned = parameters.get("pre_cleaned", False)
 
     def set_table(self, table: TableSpec):
         if table.source != DATA_SOURCE.ANKI:
             raise SyncError(SYNC_ERROR_CODE.INCORRECT_SOURCE)
         else:
             self.table = table
+            self._dedup = None
+
+    def _safe_records(self, dataset : DataSet, start : int, end : int) -> list:
+        # type cleaning for rows start..end only, so the whole dataset is never converted at once
+        chunk = DataSet(dataset.columns, [ record.asdict() for record in dataset.records[start:end] ])
+        safe_chunk : DataSet = chunk.make_write_safe(self.type_clean).op_returns["safe_data"]
+        return [ record.asdict() for record in safe_chunk.records ]
+
+    def prepare(self, dataset : DataSet) -> DataSet:
+        '''Type clean a page and keep only the note type's fields (and id_column), ready for a pre_cleaned write.'''
+        keep = set( col.name for col in AnkiReader({"table": self.table}).get_columns() )
+        if self.id_column != None:
+            keep.add(self.id_column)
+        columns = [ DataColumn(COLUMN_TYPE.TEXT, col.name) for col in dataset.columns if col.name in keep ]
+        records = [ { name: value for name, value in record.items() if name in keep } for record in self._safe_records(dataset, 0, len(dataset.records)) ]
+        return DataSet(columns, records)
+
+    def _read_existing(self, columns : list, loop_callback = None, note_ids : list = None) -> ColumnarDataSet:
+        '''Existing notes of the table (or just note_ids) as cleaned records with a NOTE_ID column, read page by page.'''
+        ar = AnkiReader({"table": self.table, "include_ids": True, "columns": columns, "trace": self.trace, "note_ids": note_ids, "columnar": True})
+        existing = None
+        handle = None
+        while handle == None or not handle.done:
+            handle = ar.read_records_sync(self.chunk_size, handle)
+            if existing == None:
+                existing = ColumnarDataSet(handle.records.columns + [ DataColumn(COLUMN_TYPE.TEXT, NOTE_ID) ])
+            existing.add_records(handle.records.records)
+            if loop_callback != None:
+                loop_callback(with_summary(SyncStatus(-1, len(existing.records), SYNC_STATUS_CODE.READING_SOURCE), self.trace))
+        return existing
+
+    def plan_merge(self, left : DataSet, primary_key : str, loop_callback : Callable[[SyncStatus], None] = None, find_orphans : bool = False) -> MergePlan:
+        '''Join left to the existing notes on primary_key, after type cleaning, without writing anything.
+
+        With find_orphans set the whole note type is always read, and notes no row matched are listed as orphans.'''
+        note_fields = [ col.name for col in AnkiReader({"table": self.table}).get_columns() ]
+        field_names = [ name for name in left.column_names if name != "tags" and name in note_fields ]
+        if primary_key not in field_names:
+            raise SyncError(SYNC_ERROR_CODE.PARAMETER_NOT_FOUND, f"Primary key {primary_key} isn't a field of both the records and the note type.")
+
+        # rows already in the id map go straight to their note; only if some aren't is the whole note type read
+        mapped = {}
+        if self.id_map != None and self.id_column in left.column_names:
+            with self.trace.stage("anki.id_map"):
+                mapped = self.id_map.notes_for_pages([ record.asdict()[self.id_column] for record in left.records ])
+        if len(mapped) > 0 and len(mapped) == len(left.records) and not find_orphans:
+            existing = self._read_existing(field_names, loop_callback, list(mapped.values()))
+        else:
+            existing = self._read_existing(field_names, loop_callback)
+        with self.trace.stage("anki.update_join"):
+            by_key = DataSetIndex(existing, primary_key)
+            by_id = DataSetIndex(existing, NOTE_ID) if len(mapped) > 0 else None
+        existing_rows = existing.records
+
+        plan = MergePlan()
+        matched = bytearray(len(existing_rows))
+        total = len(left.records)
+        for start in range(0, total, self.chunk_size):
+            end = min(start + self.chunk_size, total)
+            with self.trace.stage("anki.type_clean"):
+                safe_records = self._safe_records(left, start, end)
+            with self.trace.stage("anki.update_diff"):
+                for row, record in zip(range(start, end), safe_records):
+                    matches = by_id.get(mapped.get(str(record.get(self.id_column)))) if by_id != None else []
+                    if len(matches) == 0:
+                        matches = by_key.get(html_to_text(str(record[primary_key])))
+                    if len(matches) == 0:
+                        plan.unmatched.append(row)
+                        continue
+                    for match in matches:
+                        matched[match] = 1
+                        # both sides are compared as cleaned text, so formatting-only differences don't count as changes
+                        current = existing_rows[match]
+                        note_id = current[NOTE_ID]
+                        if self.id_map != None and self.id_column in record:
+                            plan.pairs.append((record[self.id_column], note_id))
+                        changed = { name: str(record[name]) for name in field_names if name in record and html_to_text(str(record[name])) != current.get(name) }
+                        if len(changed) == 0:
+                            plan.unchanged += 1
+                        else:
+                            plan.changes.append((note_id, changed))
+        if find_orphans:
+            note_ids = existing.column_values(NOTE_ID)
+            plan.orphans = [ note_ids[row] for row in range(len(matched)) if not matched[row] ]
+        return plan
+
+    def update_table(self, left : DataSet, primary_key : str, loop_callback : Callable[[SyncStatus], None] = None, plan : MergePlan = None) -> UpdateResult:
+        '''Update existing notes from left, joined on primary_key, writing only notes whose fields changed.
+
+        plan, from plan_merge on the same left, saves working the join out again.'''
+        if plan == None:
+            plan = self.plan_merge(left, primary_key, loop_callback)
+        result = UpdateResult(unchanged = plan.unchanged, unmatched = plan.unmatched)
+        changes = plan.changes
+        undo_id = mw.col.add_custom_undo_entry("Anchor: Update Records") if hasattr(mw.col, "add_custom_undo_entry") else None
+        for start in range(0, len(changes), self.chunk_size):
+            chunk_start = perf_counter()
+            batch = changes[start:start + self.chunk_size]
+            with self.trace.stage("anki.update"):
+                notes = []
+                for note_id, changed in batch:
+                    note = mw.col.getNote(note_id)
+                    for name, value in changed.items():
+                        note[name] = value
+                    notes.append(note)
+                self._update_notes(notes, undo_id)
+            self.trace.count("anki.update", len(notes))
+            result.updated += len(notes)
+            if self.chunk_callback != None:
+                self.chunk_callback(len(notes), perf_counter() - chunk_start)
+        if len(plan.pairs) > 0:
+            self.id_map.record(plan.pairs)
+        return result
 
-    # def update_table(self, left : DataSet, primary_key : str, loop_callback : Callable[[SyncStatus], None]):
-    #     ar = AnkiReader({"table": self.table})
-    #     handle = ar.read_records_sync(100, include_ids=True)
-    #     right = handle.records
-    #     loop_callback(SyncStatus(-1, len(right.records), SYNC_STATUS_CODE.READING_SOURCE))
+    def plan_hard_merge(self, left : DataSet, primary_key : str) -> list:
+        '''Ids of the notes a hard merge from left would delete: those no row of left matches.'''
+        return self.plan_merge(left, primary_key, find_orphans = True).orphans
 
-    #     while not handle.done:
-    #         handle = ar.read_records_sync(100, next_iterator=handle, include_ids=True)
-    #         right.add_records(handle.records)
-    #         loop_callback(SyncStatus(-1, len(right.records), SYNC_STATUS_CODE.READING_SOURCE))
+    def delete_notes(self, note_ids : list, batch_size : int = 5000) -> int:
+        '''Remove notes in large batches, as one undo step.'''
+        undo_id = mw.col.add_custom_undo_entry("Anchor: Delete Records") if hasattr(mw.col, "add_custom_undo_entry") else None
+        for start in range(0, len(note_ids), batch_size):
+            batch = note_ids[start:start + batch_size]
+            with self.trace.stage("anki.delete"):
+                if hasattr(mw.col, "remove_notes"):
+                    mw.col.remove_notes(batch)
+                else:
+                    mw.col.remNotes(batch)
+                if undo_id != None:
+                    mw.col.merge_undo_entries(undo_id)
+            self.trace.count("anki.delete", len(batch))
+            if self.id_map != None:
+                self.id_map.remove_notes(batch)
+        return len(note_ids)
+
+    def _update_notes(self, notes : list, undo_id : int = None):
+        if hasattr(mw.col, "update_notes"):
+            mw.col.update_notes(notes)
+        else:
+            for note in notes:
+                note.flush()
+        if undo_id != None:
+            mw.col.merge_undo_entries(undo_id)
 
     def _make_template(self, fields = list):
         # actually makes a side of a card, in language users understand
@@ -66,48 +322,110 @@ class AnkiWriter(SourceWriter):
         new_model["tmpls"] = [self._make_template(dataset.column_names)]
         changes = mw.col.models.add_dict(new_model)
         new_id = mw.col.models.id_for_name(name)
+        schema_cache.invalidate(DATA_SOURCE.ANKI)
         return TableSpec(DATA_SOURCE.ANKI, {"id": int(new_id)}, name)
 
     def _write_records(self, dataset : DataSet, limit: int = -1, next_iterator : AnkiSyncHandle = None):
         # just writes to the default deck for now, filtering on note_type (as that's the actual schema)
-        type_clean = {
-            COLUMN_TYPE.SELECT: COLUMN_TYPE.TEXT,
-            COLUMN_TYPE.DATE: COLUMN_TYPE.TEXT,
-            COLUMN_TYPE.MULTI_SELECT: COLUMN_TYPE.TEXT
-        }
-        
-        if next_iterator != None:
-            remaining_records = copy.copy(next_iterator.handle)
+        # the handle carries a row index into the original dataset; rows are only type cleaned when written
+        start = next_iterator.it if next_iterator != None else 0
+        total = len(dataset.records)
+        if limit < 0:
+            end = total
         else:
-            remaining_records = deque()
-            safe_data : DataSet = dataset.make_write_safe(type_clean).op_returns["safe_data"]
-            for record in safe_data.records:
-                remaining_records.append(record.asdict())
+            end = min(start + limit, total)
 
         note_type = mw.col.models.get(self.table.parameters["id"])
         target_deck = int(mw.col.decks.all_names_and_ids()[0].id)
 
-        cur_it = 0
-
-        while len(remaining_records) > 0 and cur_it != limit:
-            cur_it += 1
-            record = remaining_records.popleft()
-            new_note = mw.col.new_note(note_type)
-            for field in record:
-                new_note[field] = str(record[field]) # prevents Nones from causing issues
-            mw.col.add_note(new_note, target_deck)
-        
-        if len(remaining_records) == 0:
-            remaining_records = None
-            
-        done = False
-        if remaining_records == None:
-            done = True
-
-        out_it = AnkiSyncHandle(source = DATA_SOURCE.ANKI, records = dataset, handle = remaining_records, done = done)
+        # every chunk of every page is merged into one undo step
+        undo_id = next_iterator.undo_id if next_iterator != None else None
+        if undo_id == None and hasattr(mw.col, "add_custom_undo_entry"):
+            undo_id = mw.col.add_custom_undo_entry("Anchor: Write Records")
+        chunk_timings = next_iterator.chunk_timings if next_iterator != None else []
+
+        dedup = next_iterator.dedup if next_iterator != None else self._dedup
+        skipped = next_iterator.skipped if next_iterator != None else 0
+        if self.dedup and dedup == None:
+            with self.trace.stage("anki.dedup_keys"):
+                dedup = _Dedup(self.table.parameters["id"], mw.col.models.fieldNames(note_type), self.dedup_column)
+            self._dedup = dedup
+
+        cur_it = start
+
+        while cur_it < end:
+            chunk_start = perf_counter()
+            chunk_end = min(cur_it + self.chunk_size, end)
+            if self.pre_cleaned:
+                safe_records = [ record.asdict() for record in dataset.records[cur_it:chunk_end] ]
+            else:
+                with self.trace.stage("anki.type_clean"):
+                    safe_records = self._safe_records(dataset, cur_it, chunk_end)
+            if self.id_map != None and self.id_column != None:
+                with self.trace.stage("anki.id_map"):
+                    mapped = self._mapped_pages(safe_records)
+            else:
+                mapped = set()
+            with self.trace.stage("anki.build_notes"):
+                notes = []
+                page_ids = []
+                for record in safe_records:
+                    if len(mapped) > 0 and str(record.get(self.id_column)) in mapped:
+                        skipped += 1
+                        continue
+                    if dedup != None:
+                        if dedup.is_duplicate(record):
+                            skipped += 1
+                            continue
+                        dedup.add(record)
+                    new_note = mw.col.new_note(note_type)
+                    for field in record:
+                        if field == self.id_column and field not in new_note:
+                            continue # the page id only goes to the id map
+                        new_note[field] = str(record[field]) # prevents Nones from causing issues
+                    notes.append(new_note)
+                    if self.id_map != None:
+                        page_ids.append(record.get(self.id_column))
+            if self.trace.enabled:
+                self.trace.count("anki.write", len(notes), sum(len(value) for note in notes for value in note.fields))
+            if len(notes) > 0:
+                with self.trace.stage("anki.write"):
+                    self._add_notes(notes, target_deck, undo_id)
+                if self.id_map != None:
+                    # notes have their ids once added
+                    self.id_map.record([ (page_id, note.id) for page_id, note in zip(page_ids, notes) if page_id != None ])
+            cur_it = chunk_end
+            elapsed = perf_counter() - chunk_start
+            chunk_timings.append((len(notes), elapsed))
+            if self.chunk_callback != None:
+                self.chunk_callback(len(notes), elapsed)
+
+        done = cur_it >= total
+
+        out_it = AnkiSyncHandle(source = DATA_SOURCE.ANKI, records = dataset, handle = None, done = done, it = cur_it, undo_id = undo_id, chunk_timings = chunk_timings, trace = self.trace, dedup = dedup, skipped = skipped)
 
         return out_it
 
+    def _mapped_pages(self, records : list) -> set:
+        # page ids of records already paired with a note that still exists
+        page_ids = [ str(record[self.id_column]) for record in records if record.get(self.id_column) != None ]
+        mapped = self.id_map.notes_for_pages(page_ids) if len(page_ids) > 0 else {}
+        if len(mapped) == 0:
+            return set()
+        existing = set(mw.col.db.list(f"select id from notes where id in {ids2str(mapped.values())}"))
+        return { page_id for page_id, note_id in mapped.items() if note_id in existing }
+
+    def _add_notes(self, notes : list, deck_id : int, undo_id : int = None):
+        if hasattr(mw.col, "add_notes"):
+            from anki.collection import AddNoteRequest
+            mw.col.add_notes([ AddNoteRequest(note, deck_id) for note in notes ])
+        else:
+            # older Anki versions have no bulk add
+            for note in notes:
+                mw.col.add_note(note, deck_id)
+        if undo_id != None:
+            mw.col.merge_undo_entries(undo_id)
+
     async def write_records(self, dataset : DataSet, limit : int = -1, next_iterator : AnkiSyncHandle = None):
         return self._write_records(dataset, limit, next_iterator)
 
@@ -122,10 +440,29 @@ class AnkiReader(SourceReader):
         self.deck_name = None
         self.note_type_name = None
         self.table = None
+        # bulk reads pull each page from the notes table in one query; False falls back to one getNote per id
+        self.bulk_read = parameters.get("bulk_read", True)
+        # incremental reads: only notes with mod at or after this (seconds) are read. Mods are whole seconds, so
+        # notes edited in the same second as the last sync are read again rather than missed.
+        self.modified_since = parameters.get("modified_since")
+        self.trace = parameters.get("trace", NULL_TRACE)
         if "table" in parameters:
             self.table = parameters["table"] # this is actually the card type
-        # if "deck_name" in parameters:
-        #     self.deck_name = parameters["deck_name"]
+        # filters, compiled into the find_notes search
+        if "deck_name" in parameters:
+            self.deck_name = parameters["deck_name"]
+        self.tag = parameters.get("tag")
+        # projection: only these columns (field names, or "tags") are read; None reads everything
+        self.projection = parameters.get("columns")
+        # adds each note's id to its record under NOTE_ID
+        self.include_ids = parameters.get("include_ids", False)
+        # read exactly these notes instead of searching the note type
+        self.note_ids = parameters.get("note_ids")
+        # pages come back as ColumnarDataSets, for callers holding whole large note types in memory
+        self.columnar = parameters.get("columnar", False)
+        # clean field values across a process pool for reads of at least parallel_threshold notes
+        self.parallel = parameters.get("parallel", False)
+        self.parallel_threshold = parameters.get("parallel_threshold", PARALLEL_THRESHOLD)
 
     def set_table(self, table: TableSpec):
         if table.source != DATA_SOURCE.ANKI:
@@ -134,16 +471,22 @@ class AnkiReader(SourceReader):
             self.table = table
 
     def get_decks(self) -> list:
-        return mw.col.decks.all_names_and_ids()
+        return list(schema_cache.get(DATA_SOURCE.ANKI, None, "decks", mw.col.decks.all_names_and_ids))
 
     def get_tables(self) -> list[TableSpec]:
         if mw.col == None:
             return []
+        return list(schema_cache.get(DATA_SOURCE.ANKI, None, "tables", self._load_tables))
+
+    def _load_tables(self) -> list[TableSpec]:
         note_types = mw.col.models.all_names_and_ids()
         # decks = mw.col.decks.all_names_and_ids(include_filtered=False)
         return [TableSpec(DATA_SOURCE.ANKI, {"id": nt.id}, str(nt.name) ) for nt in note_types]
 
     def get_columns(self):
+        return list(schema_cache.get(DATA_SOURCE.ANKI, self.table.parameters["id"], "columns", self._load_columns))
+
+    def _load_columns(self):
         nt : NoteType = mw.col.models.get(self.table.parameters["id"])
         field_names = mw.col.models.fieldNames(nt)
         return [ self._field_to_column(fn) for fn in field_names ]
@@ -151,13 +494,115 @@ class AnkiReader(SourceReader):
     def _read_records(self, limit: int = -1, next_iterator : AnkiSyncHandle = None):
         if self.table == None:
             raise SyncError(SYNC_ERROR_CODE.PARAMETER_NOT_FOUND, "No table set in AnkiReader; can't read records.")
-        note_type_name = self.table.name
-        note_ids = mw.col.find_notes(f"note:\"{note_type_name}\"")
-        columns = self.get_columns()
-        ds = DataSet(columns)
-        records = [ self._note_to_record(mw.col.getNote(id)) for id in note_ids ]
+        if next_iterator != None:
+            note_ids = next_iterator.id_list
+            start = next_iterator.it
+            max_mod = next_iterator.max_mod
+        else:
+            with self.trace.stage("anki.find_notes"):
+                note_ids = self._find_note_ids()
+            start = 0
+            max_mod = 0
+
+        if limit < 0:
+            end = len(note_ids)
+        else:
+            end = min(start + limit, len(note_ids))
+
+        all_columns = self.get_columns()
+        # fields are picked by position from flds, so keep each projected field's index
+        fields = [ (i, col.name) for i, col in enumerate(all_columns) if col.name != "tags" and self._projected(col.name) ]
+        columns = [ col for col in all_columns if self._projected(col.name) ]
+        include_tags = self._projected("tags")
+        ds = ColumnarDataSet(columns) if self.columnar else DataSet(columns)
+        if self.bulk_read:
+            records, page_mod = self._read_notes_bulk(note_ids[start:end], fields, include_tags, len(note_ids))
+        else:
+            records, page_mod = self._read_notes_single(note_ids[start:end], [ name for _, name in fields ], include_tags)
         ds.add_records(records)
-        return AnkiSyncHandle(ds, DATA_SOURCE.ANKI, None, True)
+        done = end >= len(note_ids)
+        return AnkiSyncHandle(ds, DATA_SOURCE.ANKI, None, done, id_list = note_ids, it = end, max_mod = max(max_mod, page_mod), trace = self.trace)
+
+    def _projected(self, column_name : str) -> bool:
+        return self.projection == None or column_name in self.projection
+
+    def _search_string(self) -> str:
+        terms = [ f"note:{self._quote(self.table.name)}" ]
+        if self.deck_name != None:
+            terms.append(f"deck:{self._quote(self.deck_name)}")
+        if self.tag != None:
+            terms.append(f"tag:{self._quote(self.tag)}")
+        return " ".join(terms)
+
+    def _quote(self, value : str) -> str:
+        return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    def _find_note_ids(self) -> list:
+        # sorted so that the cursor is stable between pages
+        if self.note_ids != None:
+            return sorted(self.note_ids)
+        if self.modified_since != None and self.deck_name == None and self.tag == None:
+            return mw.col.db.list("select id from notes where mid = ? and mod >= ? order by id", int(self.table.parameters["id"]), int(self.modified_since))
+        note_ids = mw.col.find_notes(self._search_string())
+        if self.modified_since != None:
+            # searches only filter on days, so mod is checked against the notes table
+            return mw.col.db.list(f"select id from notes where id in {ids2str(note_ids)} and mod >= ? order by id", int(self.modified_since))
+        return sorted(note_ids)
+
+    def _read_notes_single(self, note_ids : list, field_names : list = None, include_tags : bool = True):
+        records = []
+        max_mod = 0
+        for id in note_ids:
+            with self.trace.stage("anki.get_note"):
+                note = mw.col.getNote(id)
+            record = self._note_to_record(note, field_names, include_tags)
+            if self.include_ids:
+                record[NOTE_ID] = id
+            records.append(record)
+            max_mod = max(max_mod, note.mod)
+        return records, max_mod
+
+    def _read_notes_bulk(self, note_ids : list, fields : list, include_tags : bool = True, read_size : int = None):
+        # one query for the whole page instead of building a Note object per id
+        if len(note_ids) == 0:
+            return [], 0
+        with self.trace.stage("anki.query"):
+            rows = mw.col.db.all(f"select id, flds, tags, mod from notes where id in {ids2str(note_ids)}")
+        if self.trace.enabled:
+            self.trace.count("anki.query", len(rows), sum(len(row[1]) for row in rows))
+        with self.trace.stage("anki.to_records"):
+            records, max_mod = self._rows_to_records(note_ids, rows, fields, include_tags, read_size)
+        self.trace.count("anki.to_records", len(records))
+        return records, max_mod
+
+    def _rows_to_records(self, note_ids : list, rows : list, fields : list, include_tags : bool = True, read_size : int = None):
+        # fields: (index in flds, name) for each projected field; unprojected fields are never cleaned.
+        # read_size is the number of notes in the whole read, which decides whether the pool is used for this page.
+        by_id = { row[0]: row for row in rows }
+        ordered = [ by_id[id] for id in note_ids if id in by_id ] # ids missing were deleted since the id list was taken
+        names = [ name for _, name in fields ]
+        raw = []
+        for _, flds, _, _ in ordered:
+            values = flds.split(FIELD_SEPARATOR)
+            # notes missing trailing fields read as empty, as they do in Anki
+            raw.append([ values[i] if i < len(values) else "" for i, _ in fields ])
+
+        if self.parallel:
+            cleaned = parallel_map_chunks(clean_field_rows, raw, self.parallel_threshold, size = read_size)
+        else:
+            cleaned = [ [ self._remove_html_basic(value) for value in row ] for row in raw ]
+
+        records = []
+        max_mod = 0
+        for (id, _, tags, mod), values in zip(ordered, cleaned):
+            record = dict(zip(names, values))
+            if self.include_ids:
+                record[NOTE_ID] = id
+            if include_tags:
+                record["tags"] = mw.col.tags.split(tags)
+            records.append(record)
+            max_mod = max(max_mod, mod)
+        return records, max_mod
 
     async def read_records(self, limit : int = -1, next_iterator = None):
         return self._read_records(limit, next_iterator)
@@ -178,15 +623,22 @@ class AnkiReader(SourceReader):
         else: type = COLUMN_TYPE.TEXT
         return DataColumn(type, fieldName)
 
-    def _note_to_record(self, note: Note):
+    def _note_to_record(self, note: Note, field_names : list = None, include_tags : bool = True):
         out_dict = {}
         for k, v in note.items():
-            if k != "tags":
+            if k != "tags" and (field_names == None or k in field_names):
                 out_dict[k] = self._remove_html_basic(v)
-        out_dict["tags"] = note.tags
+        if include_tags:
+            out_dict["tags"] = note.tags
         return out_dict
 
     def _remove_html_basic(self, string: str):
-        # This is probably a bit hacky, but should be ok.
-        # Proper HTML handling requires an XML library.
-        return sub("<[^>]*>", "", string)
\ No newline at end of file
+        # Proper HTML handling requires an XML library; html_to_text covers what Anki fields actually contain.
+        return html_to_text(string)
+
+def _invalidate_schema_cache(changes, handler):
+    # note type / deck edits made anywhere in Anki make the cached Anki schema stale
+    if getattr(changes, "notetype", True) or getattr(changes, "deck", True):
+        schema_cache.invalidate(DATA_SOURCE.ANKI)
+
+gui_hooks.operation_did_execute.append(_invalidate_schema_cache)
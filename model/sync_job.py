@@ -0,0 +1,210 @@
+from time import monotonic
+from .instrument import NULL_TRACE
+
+# A sync job moves every record from a reader to a writer one page at a time,
+# so that it can run off the GUI thread and report progress between pages.
+
+class SyncJob():
+    '''Read from reader and write to writer in pages of page_size records.'''
+    def __init__(self, reader, writer, page_size : int = 500, progress_interval : float = 0.1, trace = NULL_TRACE, trace_path : str = None, journal = None, key_column : str = None, snapshot = None, watermark = None, resume = None, only_added : bool = False):
+        self.reader = reader
+        self.writer = writer
+        self.page_size = page_size
+        # job level stages go to trace; if trace_path is set the trace is written there as JSON after the run
+        self.trace = trace
+        self.trace_path = trace_path
+        # optional SyncJournal: each written page is committed to it, and a restarted job skips what it already wrote.
+        # Rows are matched by key_column when given, otherwise by position in the source.
+        self.journal = journal
+        self.key_column = key_column
+        # resume(source_cursor) -> read handle, for sources with their own cursor (Notion's start_cursor). A restarted
+        # job then carries on after the last committed page; such sources are never skipped through by position,
+        # since their order isn't guaranteed to be stable between runs.
+        self.resume = resume
+        # optional SnapshotBuilder: every page read is added to it and it's saved once the job succeeds.
+        # With only_added set, rows whose key the previous snapshot has are never written again (append-only writers).
+        self.snapshot = snapshot
+        self.only_added = only_added
+        # optional IncrementalSync whose filter the reader was given; its advanced watermark is saved once the job succeeds
+        self.watermark = watermark
+        # minimum seconds between progress reports; the final report is always sent
+        self.progress_interval = progress_interval
+        self.cancelled = False
+        self.rows_done = 0
+        self.rows_total = -1
+
+    def cancel(self):
+        # checked between pages
+        self.cancelled = True
+
+    def _total(self, handle) -> int:
+        # Anki read handles know the whole id list up front; other sources report -1 (unknown)
+        id_list = getattr(handle, "id_list", None)
+        if id_list:
+            return len(id_list)
+        return -1
+
+    def run(self, progress = None):
+        '''Run the job; progress(rows_done, rows_total) is called between pages, throttled.'''
+        try:
+            with self.trace.stage("job.total"):
+                rows = self._run(progress)
+            if not self.cancelled:
+                if self.journal != None:
+                    self.journal.finish()
+                if self.snapshot != None:
+                    self.snapshot.save()
+                if self.watermark != None:
+                    self.watermark.save()
+            return rows
+        finally:
+            if self.snapshot != None:
+                self.snapshot.close()
+            if self.trace_path != None:
+                self.trace.dump(self.trace_path)
+
+    def _resume_handle(self):
+        '''Read handle to continue an interrupted job from, or None to read the source from the start.'''
+        if self.resume == None or self.journal == None or not self.journal.resuming or self.journal.source_cursor == None:
+            return None
+        self.rows_done = self.journal.cursor
+        return self.resume(self.journal.source_cursor)
+
+    def _source_cursor(self, read_it):
+        # where the source carries on after read_it: an Anki read's row offset, otherwise the handle's own cursor
+        if hasattr(read_it, "id_list"):
+            return read_it.it
+        return getattr(read_it, "handle", None)
+
+    def _unwritten(self, page, rows_before : int):
+        '''The part of page that hasn't been written yet, by an interrupted run of this job or, with only_added, by any earlier one.'''
+        page = self._not_journaled(page, rows_before)
+        if self.only_added and self.snapshot != None:
+            with self.trace.stage("job.snapshot_diff"):
+                page = self.snapshot.added(page)
+        return page
+
+    def _not_journaled(self, page, rows_before : int):
+        if self.journal == None or not self.journal.resuming:
+            return page
+        if self.key_column == None and self.resume != None:
+            return page
+        records = page.records
+        if self.key_column != None:
+            keep = [ r.asdict() for r in records if str(r.asdict()[self.key_column]) not in self.journal.committed_ids ]
+        else:
+            skip = max(0, min(len(records), self.journal.cursor - rows_before))
+            if skip == 0:
+                return page
+            keep = [ r.asdict() for r in records[skip:] ]
+        if len(keep) == len(records):
+            return page
+        return type(page)(page.columns, keep)
+
+    def _commit(self, page, rows_after : int, read_it):
+        if self.journal == None:
+            return
+        ids = [ str(r.asdict()[self.key_column]) for r in page.records ] if self.key_column != None else []
+        self.journal.commit(max(rows_after, self.journal.cursor), ids, self._source_cursor(read_it))
+
+    def _run(self, progress = None):
+        last_report = 0.0
+        read_it = self._resume_handle()
+        done = False
+        while not done and not self.cancelled:
+            with self.trace.stage("job.read"):
+                read_it = self.reader.read_records_sync(self.page_size, read_it)
+            self.rows_total = self._total(read_it)
+            page = read_it.records
+            self.trace.count("job.read", len(page.records))
+            unwritten = self._unwritten(page, self.rows_done)
+            with self.trace.stage("job.write"):
+                write_it = self.writer.write_records_sync(unwritten)
+                while not write_it.done:
+                    write_it = self.writer.write_records_sync(unwritten, next_iterator = write_it)
+            self.trace.count("job.write", len(unwritten.records))
+            self.rows_done += len(page.records)
+            self._commit(unwritten, self.rows_done, read_it)
+            if self.snapshot != None:
+                self.snapshot.add_page(page)
+            done = read_it.done
+            now = monotonic()
+            if progress != None and (done or now - last_report >= self.progress_interval):
+                last_report = now
+                progress(self.rows_done, self.rows_total)
+        return self.rows_done
+
+
+class MergeJob(SyncJob):
+    '''Soft / hard merge of the reader's records into an AnkiWriter's table, joined on primary_key.
+
+    Existing notes are updated in place, unmatched rows are appended and, for hard merges, notes with no
+    source row are deleted. The writer should be pre_cleaned, as appended rows go through its prepare().
+    confirm_delete(count) is asked before anything is deleted; returning False
+    cancels the job before any change is made. With columnar set, the source is held as a ColumnarDataSet.
+    A soft merge can take a watermark, its reader only returning rows changed since; a hard merge has to
+    read everything to know what to delete.'''
+    def __init__(self, reader, writer, primary_key : str, merge_mode : int, page_size : int = 500, progress_interval : float = 0.1,
+                 trace = NULL_TRACE, trace_path : str = None, confirm_delete = None, columnar : bool = False, watermark = None):
+        super().__init__(reader, writer, page_size, progress_interval, trace, trace_path, watermark = watermark)
+        self.primary_key = primary_key
+        self.merge_mode = getattr(merge_mode, "value", merge_mode)
+        self.confirm_delete = confirm_delete
+        self.columnar = columnar
+        self.deleted = 0
+
+    def _read_all(self):
+        read_it = None
+        left = None
+        while (read_it == None or not read_it.done) and not self.cancelled:
+            with self.trace.stage("job.read"):
+                read_it = self.reader.read_records_sync(self.page_size, read_it)
+            if left == None:
+                left = read_it.records
+                if self.columnar:
+                    from .columnar import ColumnarDataSet
+                    left = ColumnarDataSet.from_dataset(left)
+            else:
+                left.add_records([ r.asdict() for r in read_it.records.records ])
+        return left
+
+    def _run(self, progress = None):
+        from .dataset_index import HARD_MERGE
+        left = self._read_all()
+        if left == None or self.cancelled:
+            return 0
+        self.rows_total = len(left.records)
+
+        # one join decides both the updates and, for hard merges, the deletes
+        with self.trace.stage("job.plan"):
+            plan = self.writer.plan_merge(left, self.primary_key, find_orphans = self.merge_mode == HARD_MERGE)
+        delete_ids = plan.orphans
+        if len(delete_ids) > 0 and self.confirm_delete != None and not self.confirm_delete(len(delete_ids)):
+            self.cancelled = True
+            return 0
+        # rows to append are cleaned and cut down to note fields before any update is committed, so a
+        # source column that isn't a field can't fail the merge halfway through
+        new_rows = None
+        if len(plan.unmatched) > 0:
+            with self.trace.stage("job.prepare"):
+                new_rows = self.writer.prepare(type(left)(left.columns, [ left.records[row].asdict() for row in plan.unmatched ]))
+
+        with self.trace.stage("job.update"):
+            result = self.writer.update_table(left, self.primary_key, plan = plan)
+        self.rows_done = result.updated + result.unchanged
+        if progress != None:
+            progress(self.rows_done, self.rows_total)
+
+        if new_rows != None:
+            with self.trace.stage("job.write"):
+                write_it = self.writer.write_records_sync(new_rows)
+                while not write_it.done:
+                    write_it = self.writer.write_records_sync(new_rows, next_iterator = write_it)
+            self.rows_done += len(result.unmatched)
+
+        if len(delete_ids) > 0:
+            with self.trace.stage("job.delete"):
+                self.deleted = self.writer.delete_notes(delete_ids)
+        if progress != None:
+            progress(self.rows_done, self.rows_total)
+        return self.rows_done
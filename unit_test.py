@@ -99,5 +99,232 @@ class AnkiTest(unittest.TestCase):
                 tsv = TsvWriter(TableSpec(DATA_SOURCE.TSV, {"file_path": "./test_output/anki_write_it.tsv", "absolute_path": self.abs_path}, "anki_write_it"))
                 tsv.create_table_sync(records)
 
+            with self.subTest(): # test reading records back one page at a time
+                ar = self.module.AnkiReader({"include_ids": True})
+                ar.set_table(table)
+                expected_ids = sorted(self.module.mw.col.find_notes('note:"Iterative Write Test"'))
+                it = ar.read_records_sync(3)
+                self.assertEqual(len(it.records.records), 3)
+                self.assertFalse(it.done)
+                read_ids = [ record.asdict()[self.module.NOTE_ID] for record in it.records.records ]
+                while not it.done:
+                    it = ar.read_records_sync(3, it)
+                    self.assertLessEqual(len(it.records.records), 3)
+                    read_ids += [ record.asdict()[self.module.NOTE_ID] for record in it.records.records ]
+                # pages neither overlap nor skip a note
+                self.assertEqual(read_ids, expected_ids)
+
+            with self.subTest(): # test updating only the notes that changed
+                aw = self.module.AnkiWriter({})
+                aw.set_table(table)
+                rows = [ record.asdict() for record in self.ds.records ]
+                rows[1]["bad_data"] = "changed"
+                rows[0]["bad_data"] = "<b>xyz</b>" # markup only, so not a change
+                rows.append({"id": "9", "date": datetime(1999, 1, 1), "multiselect": [], "select": "9", "bad_data": "new"})
+                result = aw.update_table(DataSet(self.ds.columns, rows), "id")
+                self.assertEqual(result.updated, 1)
+                self.assertEqual(result.unchanged, 3)
+                self.assertEqual(result.unmatched, [4])
+
+            with self.subTest(): # test appending with dedup on the first field, into its own table
+                aw = self.module.AnkiWriter({})
+                dedup_table = aw.create_table(self.ds, "Dedup Write Test")
+                aw.set_table(dedup_table)
+                aw._write_records(self.ds)
+                aw = self.module.AnkiWriter({"dedup": True})
+                aw.set_table(dedup_table)
+                rows = [ record.asdict() for record in self.ds.records ]
+                rows.append({"id": "10", "date": datetime(1999, 1, 1), "multiselect": [], "select": "10", "bad_data": "new"})
+                rows.append({"id": "10", "date": datetime(1999, 1, 1), "multiselect": [], "select": "10", "bad_data": "repeat"})
+                it = aw.write_records_sync(DataSet(self.ds.columns, rows), 2)
+                while not it.done:
+                    it = aw.write_records_sync(DataSet(self.ds.columns, rows), 2, it)
+                self.assertEqual(it.skipped, 5)
+
+            with self.subTest(): # test streaming export in pages
+                from model.export import export_table
+                ar = self.module.AnkiReader({})
+                ar.set_table(table)
+                rows = export_table(ar, "./test_output/anki_export.tsv", "tsv", page_size=2)
+                self.assertEqual(rows, len(self.ds.records))
+                rows = export_table(ar, "./test_output/anki_export.jsonl", "jsonl", page_size=2)
+                self.assertEqual(rows, len(self.ds.records))
+
+class HtmlTextTest(unittest.TestCase):
+    def test_html_to_text(self):
+        from model.html_text import html_to_text
+        self.assertEqual(html_to_text("plain text"), "plain text")
+        self.assertEqual(html_to_text("<b>bold</b> text"), "bold text")
+        self.assertEqual(html_to_text("line 1<br>line 2"), "line 1\nline 2")
+        self.assertEqual(html_to_text("<div>a</div><div>b &amp; c&nbsp;d</div>"), "a\nb & c d")
+        self.assertEqual(html_to_text("&lt;b&gt;"), "<b>")
+
+class DataSetIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        cols = [ DataColumn(COLUMN_TYPE.TEXT, "id"), DataColumn(COLUMN_TYPE.TEXT, "value") ]
+        self.right = DataSet(cols, [ {"id": "1", "value": "a"}, {"id": "2", "value": "b"} ])
+        self.left = DataSet(cols, [ {"id": "2", "value": "B"}, {"id": "3", "value": "c"} ])
+
+    def test_index(self):
+        from model.dataset_index import DataSetIndex
+        index = DataSetIndex(self.right, "id")
+        self.assertEqual(index.get("2"), [1])
+        index.add_records([ {"id": "9", "value": "z"} ])
+        self.assertEqual(index.get("9"), [2])
+        self.assertNotIn("3", index)
+
+    def test_merge(self):
+        from model.dataset_index import indexed_merge, SOFT_MERGE, HARD_MERGE
+        soft = [ r.asdict() for r in indexed_merge(self.left, self.right, "id", SOFT_MERGE).records ]
+        self.assertEqual(soft, [ {"id": "1", "value": "a"}, {"id": "2", "value": "B"}, {"id": "3", "value": "c"} ])
+        hard = [ r.asdict() for r in indexed_merge(self.left, self.right, "id", HARD_MERGE).records ]
+        self.assertEqual(hard, [ {"id": "2", "value": "B"}, {"id": "3", "value": "c"} ])
+
+class MetadataCacheTest(unittest.TestCase):
+    def test_cache(self):
+        from model.metadata_cache import MetadataCache
+        cache = MetadataCache(ttl=60)
+        calls = []
+        loader = lambda: calls.append(1) or ["col"]
+        self.assertEqual(cache.get(DATA_SOURCE.ANKI, 1, "columns", loader), ["col"])
+        cache.get(DATA_SOURCE.ANKI, 1, "columns", loader)
+        self.assertEqual(len(calls), 1)
+        cache.invalidate(DATA_SOURCE.ANKI, 1)
+        cache.get(DATA_SOURCE.ANKI, 1, "columns", loader)
+        self.assertEqual(len(calls), 2)
+        expired = MetadataCache(ttl=0)
+        expired.get(DATA_SOURCE.ANKI, 1, "columns", loader)
+        expired.get(DATA_SOURCE.ANKI, 1, "columns", loader)
+        self.assertEqual(len(calls), 4)
+
+class SyncTraceTest(unittest.TestCase):
+    def test_trace(self):
+        from model.instrument import SyncTrace, NULL_TRACE
+        trace = SyncTrace()
+        with trace.stage("read"):
+            pass
+        trace.count("read", 10, 100)
+        trace.call("notion.query", 0.2)
+        summary = trace.summary()
+        self.assertEqual(summary["stages"]["read"]["rows"], 10)
+        self.assertEqual(summary["stages"]["read"]["bytes"], 100)
+        self.assertEqual(summary["calls"]["notion.query"]["count"], 1)
+        with NULL_TRACE.stage("read"):
+            pass
+        self.assertEqual(NULL_TRACE.summary(), {})
+
+    def test_traced_source(self):
+        from model.instrument import SyncTrace, NULL_TRACE, traced
+        class Source():
+            def read_records_sync(self, limit = -1, next_iterator = None):
+                return limit
+        trace = SyncTrace()
+        source = traced(Source(), trace, "notion")
+        self.assertEqual(source.read_records_sync(5), 5)
+        self.assertEqual(trace.summary()["calls"]["notion.read_records"]["count"], 1)
+        self.assertIsInstance(traced(Source(), NULL_TRACE, "notion"), Source)
+
+    def test_status_summary(self):
+        from model.instrument import SyncTrace, NULL_TRACE, with_summary
+        trace = SyncTrace()
+        trace.count("anki.query", 3)
+        status = with_summary(SyncStatus(-1, 3, SYNC_STATUS_CODE.READING_SOURCE), trace)
+        self.assertEqual(status.trace["stages"]["anki.query"]["rows"], 3)
+        self.assertFalse(hasattr(with_summary(SyncStatus(-1, 3, SYNC_STATUS_CODE.READING_SOURCE), NULL_TRACE), "trace"))
+
+class SyncJournalTest(unittest.TestCase):
+    def test_journal(self):
+        import tempfile
+        from model.journal import SyncJournal
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        directory = temp.name
+        journal = SyncJournal("download test", directory)
+        self.assertFalse(journal.resuming)
+        journal.commit(100, ["1", "2"], 100)
+        journal.commit(200, ["3"], 200)
+        with open(journal.path, "a", encoding="utf-8") as f:
+            f.write('{"cursor": 30') # torn write
+        reopened = SyncJournal("download test", directory)
+        self.assertEqual(reopened.cursor, 200)
+        self.assertEqual(reopened.committed_ids, {"1", "2", "3"})
+        reopened.finish()
+        self.assertFalse(SyncJournal("download test", directory).resuming)
+
+class SnapshotTest(unittest.TestCase):
+    def test_snapshot_diff(self):
+        import tempfile
+        from model.snapshot import Snapshot, SnapshotBuilder, content_hash, diff
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = join(directory.name, "table.snap")
+        names = ["id", "value"]
+        old = [ {"id": "1", "value": "a"}, {"id": "2", "value": "b"}, {"id": "3", "value": "c"} ]
+        Snapshot.write(path, [ (r["id"], content_hash(r, names), 0) for r in old ])
+        new = [ {"id": "1", "value": "a"}, {"id": "2", "value": "B"}, {"id": "4", "value": "d"} ]
+        with Snapshot.open(path) as snapshot:
+            result = diff(snapshot, [ (r["id"], content_hash(r, names)) for r in new ])
+            self.assertEqual(result.unchanged, ["1"])
+            self.assertEqual(result.changed, ["2"])
+            self.assertEqual(result.added, ["4"])
+            self.assertEqual(len(result.removed), 1)
+            self.assertEqual(snapshot.find("4"), -1)
+            self.assertNotEqual(snapshot.find("3"), -1)
+        # an incremental run's rows are merged into the previous snapshot
+        builder = SnapshotBuilder(path, "id", merge = True)
+        builder.add_page(DataSet([ DataColumn(COLUMN_TYPE.TEXT, name) for name in names ], new))
+        builder.save()
+        with Snapshot.open(path) as snapshot:
+            self.assertEqual(len(snapshot), 4)
+            result = diff(snapshot, [ (r["id"], content_hash(r, names)) for r in old + new[2:] ])
+            self.assertEqual(result.changed, ["2"])
+            self.assertEqual(result.unchanged, ["1", "3", "4"])
+        # append-only jobs write just the rows the previous snapshot doesn't have
+        builder = SnapshotBuilder(path, "id")
+        added = builder.added(DataSet([ DataColumn(COLUMN_TYPE.TEXT, name) for name in names ], [ {"id": "2", "value": "x"}, {"id": "5", "value": "e"} ]))
+        builder.close()
+        self.assertEqual([ record.asdict()["id"] for record in added.records ], ["5"])
+
+class IdMapTest(unittest.TestCase):
+    def test_id_map(self):
+        import tempfile
+        from model.id_map import IdMap, close
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = join(directory.name, "id_map.sqlite")
+        # cleanups run last in, first out, so the cached connection is closed before the directory goes
+        self.addCleanup(close, path)
+        id_map = IdMap(1, "db", path)
+        id_map.record([ ("page-1", 10), ("page-2", 20) ])
+        self.assertEqual(id_map.notes_for_pages(["page-1", "page-2", "page-3"]), {"page-1": 10, "page-2": 20})
+        self.assertEqual(id_map.page_for_note(20), "page-2")
+        # a note moving to another page drops its old pair
+        id_map.record([ ("page-3", 10) ])
+        self.assertEqual(id_map.note_for_page("page-1"), None)
+        self.assertEqual(id_map.note_for_page("page-3"), 10)
+        # pairs are kept per note type and database
+        self.assertEqual(len(IdMap(1, "other", path)), 0)
+        id_map.remove_notes([20])
+        self.assertEqual(len(id_map), 1)
+
+class ColumnarDataSetTest(unittest.TestCase):
+    def test_columnar_dataset(self):
+        from model.columnar import ColumnarDataSet
+        cols = [ DataColumn(COLUMN_TYPE.TEXT, "id"), DataColumn(COLUMN_TYPE.SELECT, "select"), DataColumn(COLUMN_TYPE.MULTI_SELECT, "multiselect") ]
+        records = [ {"id": str(i), "select": "abc"[i % 3], "multiselect": ["x", "y"]} for i in range(10) ]
+        ds = ColumnarDataSet(cols, records)
+        self.assertEqual(len(ds.records), 10)
+        self.assertEqual([ r.asdict() for r in ds.records ], records)
+        self.assertEqual(ds.records[-1]["id"], "9")
+        # identical multiselect values share storage
+        self.assertIs(ds._data["multiselect"][0], ds._data["multiselect"][1])
+        ds.add_records([ {"id": "10", "select": None, "multiselect": [], "tags": ["t"]} ])
+        self.assertEqual(ds.records[10].asdict()["tags"], ["t"])
+        self.assertNotIn("tags", ds.records[0].asdict())
+        ds.drop_column("select")
+        self.assertEqual(ds.column_names, ["id", "multiselect"])
+        self.assertNotIn("select", ds.records[0].asdict())
+        self.assertEqual(len(ds.to_dataset().records), 11)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file